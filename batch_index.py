@@ -0,0 +1,212 @@
+"""Headless batch indexer for destination/attraction image candidates.
+
+Reads (city, attraction) rows from CSV or JSONL, runs the same searches and
+filters as the Streamlit panels on a bounded worker pool, and appends the
+candidates to a Parquet dataset that the app serves directly when started
+with ``PRECOMPUTED_INDEX=<output dir>``.
+
+    python batch_index.py destinations.csv --output index/
+    python batch_index.py destinations.jsonl --output index/ --providers getty,unsplash --workers 8
+
+Every row produces a city search (portrait, like the destination panel)
+and, when it has an attraction, a "city attraction" search (landscape).
+Runs are resumable: searches already in the dataset or in its
+``_completed.jsonl`` log are skipped, and new results are written as
+additional part files.
+"""
+import argparse
+import csv
+import json
+import os
+import sys
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+INDEX_SCHEMA = pa.schema([
+    ("city", pa.string()),
+    ("attraction", pa.string()),
+    ("orientation", pa.string()),
+    ("providers", pa.string()),
+    ("rank", pa.int32()),
+    ("id", pa.string()),
+    ("provider", pa.string()),
+    ("thumb_url", pa.string()),
+    ("preview_url", pa.string()),
+    ("full_url", pa.string()),
+    ("width", pa.int64()),
+    ("height", pa.int64()),
+    ("description", pa.string()),
+    ("attribution", pa.string()),
+    ("caption", pa.string()),
+    ("tags", pa.list_(pa.string())),
+    ("editorial_only", pa.bool_()),
+    ("publicity", pa.bool_()),
+    ("indexed_at", pa.float64()),
+])
+
+COMPLETED_LOG = "_completed.jsonl"
+
+
+def read_rows(path):
+    """(city, attraction) pairs from a CSV with a header row or a JSONL file."""
+    rows = []
+    with open(path, newline="", encoding="utf-8") as f:
+        if path.endswith((".jsonl", ".ndjson")):
+            for line in f:
+                if line.strip():
+                    item = json.loads(line)
+                    rows.append((item.get("city", ""), item.get("attraction", "")))
+        else:
+            for item in csv.DictReader(f):
+                rows.append((item.get("city", ""), item.get("attraction", "")))
+    return [(city.strip(), (attraction or "").strip()) for city, attraction in rows if city and city.strip()]
+
+
+def plan_jobs(rows):
+    """Unique searches for the rows: one city search per city plus one per (city, attraction)."""
+    jobs, seen = [], set()
+    for city, attraction in rows:
+        for job in ((city, "", "portrait"), (city, attraction, "landscape")):
+            if job[2] == "landscape" and not attraction:
+                continue
+            if job not in seen:
+                seen.add(job)
+                jobs.append(job)
+    return jobs
+
+
+def completed_keys(app, output, providers):
+    """index_key tuples already present in the dataset or its completion log."""
+    keys = set()
+    for name in sorted(os.listdir(output)):
+        if name.endswith(".parquet"):
+            table = pq.read_table(os.path.join(output, name), columns=["city", "attraction", "orientation", "providers"])
+            for city, attraction, orientation, job_providers in zip(*(table.column(i).to_pylist() for i in range(4))):
+                keys.add(app.index_key(city, attraction, orientation, job_providers.split(",")))
+    log_path = os.path.join(output, COMPLETED_LOG)
+    if os.path.exists(log_path):
+        with open(log_path) as f:
+            for line in f:
+                if line.strip():
+                    item = json.loads(line)
+                    keys.add(app.index_key(item["city"], item["attraction"], item["orientation"], item["providers"].split(",")))
+    return keys
+
+
+def run_search(app, city, attraction, orientation, providers, max_pages, per_page, content_filter):
+    """Candidate ImageRecords for one search, filtered and deduplicated like the corresponding panel."""
+    query = f"{city} {attraction}".strip()
+    pipeline = app.portrait_filter if orientation == "portrait" else app.landscape_filter
+    if content_filter:
+        pipeline = pipeline.then(app.content_filter)
+    # Filters the provider supports are sent with the request, the rest run locally
+    # strict: a failed page fails the search, so it is retried on the next run instead of indexed short
+    images = app.fetch_many_images(query, max_pages=max_pages, per_page=per_page, orientation=orientation, providers=providers, filters=pipeline, priority="background", strict=True)
+    records = app.apply_filters(pipeline, app.normalize_images(images))
+    return app.dedupe_images(records) if app.dedup_results else records
+
+
+def to_rows(city, attraction, orientation, providers, records):
+    indexed_at = time.time()
+    return [
+        dict(
+            record._asdict(),
+            tags=list(record.tags),
+            city=city,
+            attraction=attraction,
+            orientation=orientation,
+            providers=",".join(sorted(providers)),
+            rank=rank,
+            indexed_at=indexed_at,
+        )
+        for rank, record in enumerate(records)
+    ]
+
+
+def write_part(output, rows, completed):
+    """Append one Parquet part file (atomically) and log the searches it completes."""
+    if rows:
+        name = f"part-{time.strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:8]}.parquet"
+        tmp_path = os.path.join(output, f".{name}.tmp")
+        pq.write_table(pa.Table.from_pylist(rows, schema=INDEX_SCHEMA), tmp_path)
+        os.replace(tmp_path, os.path.join(output, name))
+    with open(os.path.join(output, COMPLETED_LOG), "a") as f:
+        for item in completed:
+            f.write(json.dumps(item) + "\n")
+
+
+def import_app():
+    # Bare-mode st.* calls otherwise warn about the missing ScriptRunContext on every call
+    os.environ.setdefault("STREAMLIT_LOGGER_LEVEL", "error")
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    import unsplash_images_app
+    return unsplash_images_app
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("input", help="CSV (city,attraction header) or JSONL file")
+    parser.add_argument("--output", required=True, help="Parquet dataset directory (created if missing)")
+    parser.add_argument("--providers", default="unsplash", help="comma-separated: getty, unsplash")
+    parser.add_argument("--workers", type=int, default=4, help="searches run at the same time")
+    parser.add_argument("--max-pages", type=int, default=5)
+    parser.add_argument("--per-page", type=int, default=30)
+    parser.add_argument("--content-filter", action="store_true", help="also drop people/brand/editorial images")
+    parser.add_argument("--getty-per-hour", type=float, default=5000, help="Getty request quota (0 = unlimited)")
+    parser.add_argument("--unsplash-per-hour", type=float, default=5000, help="Unsplash request quota (0 = unlimited)")
+    parser.add_argument("--flush-every", type=int, default=25, help="searches per Parquet part file")
+    args = parser.parse_args(argv)
+
+    app = import_app()
+    providers = tuple(p.strip() for p in args.providers.split(",") if p.strip())
+    for provider, per_hour in (("getty", args.getty_per_hour), ("unsplash", args.unsplash_per_hour)):
+        if per_hour > 0:
+            app.get_provider_client(provider).limiter = app.RateLimiter(per_hour / 3600, capacity=min(per_hour, 10))
+    # Batch searches are background work, but should wait for quota instead of indexing partial results
+    app.get_upstream_scheduler().max_wait["background"] = None
+
+    os.makedirs(args.output, exist_ok=True)
+    done = completed_keys(app, args.output, providers)
+    jobs = [
+        job for job in plan_jobs(read_rows(args.input))
+        if app.index_key(job[0], job[1], job[2], providers) not in done
+    ]
+    print(f"{len(jobs)} searches to run ({len(done)} already indexed)")
+
+    pending_rows, pending_completed, failures = [], [], 0
+    started = time.time()
+    with ThreadPoolExecutor(max_workers=args.workers) as pool:
+        futures = {
+            pool.submit(run_search, app, city, attraction, orientation, providers, args.max_pages, args.per_page, args.content_filter): (city, attraction, orientation)
+            for city, attraction, orientation in jobs
+        }
+        for n, future in enumerate(as_completed(futures), 1):
+            city, attraction, orientation = futures[future]
+            try:
+                records = future.result()
+            except Exception as e:
+                failures += 1
+                print(f"[{n}/{len(jobs)}] {city} | {attraction or '-'}: failed ({e})")
+                continue
+            pending_rows.extend(to_rows(city, attraction, orientation, providers, records))
+            pending_completed.append({
+                "city": city, "attraction": attraction, "orientation": orientation,
+                "providers": ",".join(sorted(providers)), "candidates": len(records),
+            })
+            print(f"[{n}/{len(jobs)}] {city} | {attraction or '-'}: {len(records)} candidates")
+            if len(pending_completed) >= args.flush_every:
+                write_part(args.output, pending_rows, pending_completed)
+                pending_rows, pending_completed = [], []
+    if pending_completed:
+        write_part(args.output, pending_rows, pending_completed)
+
+    print(f"done in {time.time() - started:.1f}s, {failures} failed")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,451 @@
+"""Offline benchmarks for the image search pipeline.
+
+Replays synthetic (or recorded) Getty and Unsplash responses from a local
+stub HTTP server, so search latency and filter throughput can be measured
+without touching the live APIs or their quotas.
+
+    python bench_search.py                          # run and print a report
+    python bench_search.py --save bench.json        # keep results as a baseline
+    python bench_search.py --baseline bench.json    # exit 1 on regressions
+    python bench_search.py --latency 0.2 --error-rate 0.05 --sizes 100,1500
+
+Recorded fixtures: ``--fixtures DIR`` with ``getty.json`` and/or
+``unsplash.json`` (saved search responses) replays those images, cycled and
+re-numbered to fill as many pages as requested.
+"""
+import argparse
+import io
+import json
+import os
+import random
+import statistics
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+import urllib.parse
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+from PIL import Image
+
+
+def synthetic_unsplash_image(index, base_url):
+    portrait = index % 2 == 0
+    return {
+        "id": f"u{index}",
+        "width": 4000 if portrait else 6000,
+        "height": 6000 if portrait else 4000,
+        "alt_description": "a man walking past a shop sign" if index % 7 == 0 else f"old town street view {index}",
+        "tags": [{"title": "city"}, {"title": "architecture"}, {"title": "people" if index % 11 == 0 else "travel"}],
+        "urls": {
+            name: f"{base_url}/img/u{index}-{name}.jpg?ixid=stub"
+            for name in ("raw", "full", "regular", "small", "thumb")
+        },
+        "user": {"name": f"Photographer {index % 50}", "links": {"html": f"https://unsplash.com/@stub{index % 50}"}},
+    }
+
+
+def synthetic_getty_image(index, base_url):
+    portrait = index % 3 == 0
+    return {
+        "id": f"g{index}",
+        "title": f"Cityscape {index}",
+        "caption": "group of people at a corporate event" if index % 5 == 0 else f"Skyline at dusk {index}",
+        "max_dimensions": {"width": 3000 if portrait else 5000, "height": 5000 if portrait else 3000},
+        "display_sizes": [
+            {"name": name, "uri": f"{base_url}/img/g{index}-{name}.jpg", "is_watermarked": False}
+            for name in ("thumb", "preview", "comp", "high_res_comp")
+        ],
+        "editorial_segments": ["publicity"] if index % 13 == 0 else [],
+        "allowed_use": {"editorial_use_only": index % 17 == 0},
+    }
+
+
+class StubState:
+    """Configuration and counters shared by the stub request handlers."""
+
+    def __init__(self, results=1500, latency=0.0, jitter=0.0, error_rate=0.0, unsplash_page_cap=30, fixtures=None, seed=0, reuploads=True):
+        self.results = results
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.unsplash_page_cap = unsplash_page_cap
+        self.fixtures = fixtures or {}
+        self.random = random.Random(seed)
+        self.base_url = ""
+        self.requests = {}
+        self.bytes_sent = 0
+        self.matches = {}
+        self.reuploads = reuploads
+        self.jpegs = {}
+        self.lock = threading.Lock()
+
+    def count(self, route, size):
+        with self.lock:
+            self.requests[route] = self.requests.get(route, 0) + 1
+            self.bytes_sent += size
+
+    def total_requests(self, prefix=""):
+        with self.lock:
+            return sum(n for route, n in self.requests.items() if route.startswith(prefix))
+
+    def reset_counters(self):
+        with self.lock:
+            self.requests = {}
+            self.bytes_sent = 0
+
+    def jpeg(self, name):
+        """A distinct picture per result ("u12-thumb.jpg").
+
+        With ``reuploads``, results 6 and 7 of every ten show the same shot as
+        results 0 and 1, which have the same orientation on both providers.
+        """
+        shot = name.split("-")[0]
+        provider, index = shot[:1], int(shot[1:] or 0)
+        if self.reuploads and index % 10 in (6, 7):
+            index -= 6
+        key = f"{provider}{index}"
+        with self.lock:
+            if key in self.jpegs:
+                return self.jpegs[key]
+        rng = np.random.default_rng(zlib.crc32(key.encode()))
+        image = Image.fromarray(rng.integers(0, 255, (6, 9, 3), dtype=np.uint8)).resize((640, 427), Image.BILINEAR)
+        buffer = io.BytesIO()
+        image.save(buffer, format="JPEG", quality=80)
+        with self.lock:
+            self.jpegs[key] = buffer.getvalue()
+        return self.jpegs[key]
+
+    def image(self, provider, index):
+        fixture = self.fixtures.get(provider)
+        if fixture:
+            image = dict(fixture[index % len(fixture)])
+            image["id"] = f"{image.get('id', provider)}-{index}"
+            return image
+        if provider == "getty":
+            return synthetic_getty_image(index, self.base_url)
+        return synthetic_unsplash_image(index, self.base_url)
+
+    def page(self, provider, page, per_page, params=None):
+        """One page of results, after the server-side filters in ``params``; returns (images, total)."""
+        indices = self.matching(provider, params or {})
+        start = (page - 1) * per_page
+        images = [self.image(provider, index) for index in indices[start:start + per_page]]
+        if provider == "getty" and params and params.get("fields"):
+            images = [trim_getty_fields(image, params["fields"].split(",")) for image in images]
+        return images, len(indices)
+
+    def matching(self, provider, params):
+        """Result indices that pass the orientation/people/editorial filters the real APIs apply."""
+        filters = tuple(sorted(
+            (k, v) for k, v in params.items()
+            if k in ("orientation", "orientations", "number_of_people", "exclude_editorial_use_only")
+        ))
+        key = (provider, self.results, filters)
+        with self.lock:
+            if key in self.matches:
+                return self.matches[key]
+        params = dict(filters)
+        indices = [index for index in range(self.results) if stub_filter_match(self.image(provider, index), params)]
+        with self.lock:
+            self.matches[key] = indices
+        return indices
+
+
+def stub_filter_match(image, params):
+    dimensions = image.get("max_dimensions") or image
+    width, height = dimensions.get("width") or 0, dimensions.get("height") or 0
+    orientation = params.get("orientation") or params.get("orientations", "")
+    if orientation.lower().startswith("portrait") or orientation.startswith("Vertical"):
+        if height <= width:
+            return False
+    elif orientation.lower().startswith("landscape") or orientation.startswith("Horizontal"):
+        if width <= height:
+            return False
+    if params.get("exclude_editorial_use_only") == "true" and (image.get("allowed_use") or {}).get("editorial_use_only"):
+        return False
+    if params.get("number_of_people") == "none" and "people" in (image.get("caption") or ""):
+        return False
+    return True
+
+
+def trim_getty_fields(image, fields):
+    """Getty only returns the requested fields; thumb/preview/comp select display sizes."""
+    trimmed = {key: value for key, value in image.items() if key in fields and key != "display_sizes"}
+    trimmed["display_sizes"] = [size for size in image.get("display_sizes", []) if size.get("name") in fields]
+    return trimmed
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    state = None  # set by StubServer
+
+    def log_message(self, format, *args):
+        pass
+
+    def _delay_or_fail(self):
+        state = self.state
+        delay = state.latency + (state.random.uniform(0, state.jitter) if state.jitter else 0)
+        if delay:
+            time.sleep(delay)
+        if state.error_rate and state.random.random() < state.error_rate:
+            self._send(503, {"message": "stub error"}, route="error")
+            return True
+        return False
+
+    def _send(self, status, payload, route, content_type="application/json"):
+        body = payload if isinstance(payload, bytes) else json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("X-RateLimit-Limit", "5000")
+        self.send_header("X-RateLimit-Remaining", "4999")
+        self.end_headers()
+        self.wfile.write(body)
+        self.state.count(route, len(body))
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        self.rfile.read(length)
+        if self.path.startswith("/getty/oauth2/token"):
+            if not self._delay_or_fail():
+                self._send(200, {"access_token": "stub-token", "token_type": "Bearer", "expires_in": 1800}, route="getty/token")
+            return
+        self._send(404, {"message": "not found"}, route="404")
+
+    def do_GET(self):
+        url = urllib.parse.urlsplit(self.path)
+        params = dict(urllib.parse.parse_qsl(url.query))
+        if url.path.startswith("/img/"):
+            self._send(200, self.state.jpeg(url.path.rsplit("/", 1)[-1]), route="img", content_type="image/jpeg")
+            return
+        if url.path == "/getty/v3/search/images/creative":
+            if self._delay_or_fail():
+                return
+            page, per_page = int(params.get("page", 1)), int(params.get("page_size", 30))
+            images, total = self.state.page("getty", page, per_page, params)
+            self._send(200, {"result_count": total, "images": images}, route="getty/search")
+            return
+        if url.path == "/unsplash/search/photos":
+            if self._delay_or_fail():
+                return
+            per_page = min(int(params.get("per_page", 10)), self.state.unsplash_page_cap)
+            page = int(params.get("page", 1))
+            results, total = self.state.page("unsplash", page, per_page, params)
+            total_pages = -(-total // per_page)
+            self._send(200, {"total": total, "total_pages": total_pages, "results": results}, route="unsplash/search")
+            return
+        self._send(404, {"message": "not found"}, route="404")
+
+
+class StubServer:
+    """Local stand-in for the Getty and Unsplash endpoints, served from a thread.
+
+    ``env()`` returns the environment variables that point the app at it;
+    they must be set before ``unsplash_images_app`` is imported.
+    """
+
+    def __init__(self, **options):
+        self.state = StubState(**options)
+        handler = type("BoundStubHandler", (StubHandler,), {"state": self.state})
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+        self.httpd.daemon_threads = True
+        self.url = f"http://127.0.0.1:{self.httpd.server_address[1]}"
+        self.state.base_url = self.url
+        self._thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def env(self):
+        return {
+            "GETTY_AUTH_URL": f"{self.url}/getty/oauth2/token",
+            "GETTY_API_URL": f"{self.url}/getty/v3",
+            "UNSPLASH_API_URL": f"{self.url}/unsplash",
+            "GETTY_API_KEY": "stub-key",
+            "GETTY_CLIENT_SECRET": "stub-secret",
+            "UNSPLASH_ACCESS_KEY": "stub-key",
+            # The stub enforces no quota; measure the search path, not the local token buckets
+            "GETTY_QUOTA_PER_HOUR": "0",
+            "UNSPLASH_QUOTA_PER_HOUR": "0",
+        }
+
+
+def load_fixtures(directory):
+    fixtures = {}
+    if not directory:
+        return fixtures
+    for provider, field in (("getty", "images"), ("unsplash", "results")):
+        path = os.path.join(directory, f"{provider}.json")
+        if os.path.exists(path):
+            with open(path) as f:
+                fixtures[provider] = json.load(f).get(field, [])
+    return fixtures
+
+
+def import_app(server):
+    """Import the Streamlit app wired to the stub server, with throwaway caches."""
+    scratch = tempfile.mkdtemp(prefix="klm-bench-")
+    os.environ.update(server.env())
+    os.environ.setdefault("SEARCH_CACHE_PATH", os.path.join(scratch, "search_cache.sqlite3"))
+    os.environ.setdefault("IMAGE_CACHE_DIR", os.path.join(scratch, "images"))
+    # Bare-mode st.* calls otherwise warn about the missing ScriptRunContext on every call
+    os.environ.setdefault("STREAMLIT_LOGGER_LEVEL", "error")
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    import unsplash_images_app
+    return unsplash_images_app
+
+
+def measure(fn, repeat, setup=None, requests_of=None):
+    """Median/min wall time over ``repeat`` runs, then one traced run for peak memory."""
+    times = []
+    for _ in range(repeat):
+        if setup:
+            setup()
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+    if setup:
+        setup()
+    before = requests_of() if requests_of else 0
+    tracemalloc.start()
+    fn()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {
+        "wall_s": statistics.median(times),
+        "min_s": min(times),
+        "peak_kb": peak / 1024,
+        "requests": (requests_of() - before) if requests_of else 0,
+    }
+
+
+def run_benchmarks(app, server, sizes, filter_sizes, repeat):
+    results = {}
+    state = server.state
+    cache = app.get_search_cache()
+
+    def cold():
+        cache.invalidate()
+
+    for provider in ("unsplash", "getty"):
+        per_page = 30 if provider == "unsplash" else 100
+        for size in sizes:
+            state.results = size
+            max_pages = -(-size // per_page)
+
+            def search(provider=provider, per_page=per_page, max_pages=max_pages):
+                app.fetch_many_images("paris", max_pages=max_pages, per_page=per_page, orientation="portrait", providers=(provider,))
+
+            def search_sequential(provider=provider, per_page=per_page, max_pages=max_pages):
+                app.fetch_many_images("paris", max_pages=max_pages, per_page=per_page, orientation="portrait", providers=(provider,), parallel=False)
+
+            def search_filtered(provider=provider, per_page=per_page, max_pages=max_pages):
+                # Orientation, editorial and people filters pushed to the provider, the rest applied locally
+                pipeline = app.portrait_filter.then(app.content_filter)
+                images = app.fetch_many_images("paris", max_pages=max_pages, per_page=per_page, orientation="portrait", providers=(provider,), filters=pipeline)
+                app.apply_filters(pipeline, app.normalize_images(images))
+
+            requests_of = lambda provider=provider: state.total_requests(f"{provider}/search")
+            results[f"fetch_many_images[{provider},{size}]"] = measure(search, repeat, setup=cold, requests_of=requests_of)
+            results[f"fetch_many_images_sequential[{provider},{size}]"] = measure(search_sequential, repeat, setup=cold, requests_of=requests_of)
+            results[f"fetch_many_images_cached[{provider},{size}]"] = measure(search, repeat, requests_of=requests_of)
+            results[f"search_and_filter[{provider},{size}]"] = measure(search_filtered, repeat, setup=cold, requests_of=requests_of)
+
+        # Hashes are recomputed each run; the thumbnails come from the (warmed) image cache
+        records = app.normalize_images(app.fetch_many_images("paris", max_pages=max(1, sizes[0] // per_page), per_page=per_page, providers=(provider,)))
+        app.dedupe_images(records)
+        results[f"dedupe_images[{provider},{len(records)}]"] = measure(
+            lambda records=records: app.dedupe_images(records), repeat, setup=lambda: app.get_phash_cache().hashes.clear()
+        )
+
+    for size in filter_sizes:
+        state.results = size
+        raw = [state.image("unsplash" if i % 2 else "getty", i) for i in range(size)]
+        records = app.normalize_images(raw)
+        for label, images in (("raw", raw), ("records", records)):
+            results[f"filter_images[{label},{size}]"] = measure(lambda images=images: app.filter_images(images), repeat)
+            results[f"filter_portrait[{label},{size}]"] = measure(lambda images=images: app.filter_portrait(images), repeat)
+            results[f"filter_landscape[{label},{size}]"] = measure(lambda images=images: app.filter_landscape(images), repeat)
+
+            def helpers(images=images):
+                for img in images:
+                    app.get_thumbnail_url(img)
+                    app.get_largest_image_url(img)
+                    app.get_image_source(img)
+
+            results[f"url_attribution_helpers[{label},{size}]"] = measure(helpers, repeat)
+        results[f"normalize_images[{size}]"] = measure(lambda raw=raw: app.normalize_images(raw), repeat)
+    return results
+
+
+def compare(results, baseline, tolerance, noise_floor):
+    """Names of benchmarks whose median wall time regressed past the tolerance."""
+    regressions = []
+    for name, result in results.items():
+        previous = baseline.get(name)
+        if not previous:
+            continue
+        slower = result["wall_s"] - previous["wall_s"]
+        if slower > noise_floor and result["wall_s"] > previous["wall_s"] * (1 + tolerance):
+            regressions.append((name, previous["wall_s"], result["wall_s"]))
+    return regressions
+
+
+def print_report(results, server):
+    print(f"{'benchmark':<52} {'wall ms':>10} {'min ms':>10} {'peak KB':>10} {'requests':>9}")
+    for name, r in results.items():
+        print(f"{name:<52} {r['wall_s'] * 1000:>10.2f} {r['min_s'] * 1000:>10.2f} {r['peak_kb']:>10.0f} {r['requests']:>9}")
+    print(f"\nstub requests: {dict(sorted(server.state.requests.items()))}, bytes sent: {server.state.bytes_sent}")
+
+
+def parse_sizes(value):
+    return [int(v) for v in value.split(",") if v.strip()]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", type=parse_sizes, default=[100, 500, 1500], help="result-set sizes for search benchmarks")
+    parser.add_argument("--filter-sizes", type=parse_sizes, default=[1500, 15000, 60000], help="batch sizes for filter/helper benchmarks")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--latency", type=float, default=0.05, help="stub response latency, seconds")
+    parser.add_argument("--jitter", type=float, default=0.0, help="extra random latency, seconds")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of stub responses that are 503")
+    parser.add_argument("--fixtures", help="directory with recorded getty.json / unsplash.json responses")
+    parser.add_argument("--save", help="write results as JSON")
+    parser.add_argument("--baseline", help="JSON results to compare against; exit 1 on regressions")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="allowed slowdown vs. baseline (0.25 = 25%%)")
+    parser.add_argument("--noise-floor", type=float, default=0.002, help="ignore slowdowns smaller than this, seconds")
+    args = parser.parse_args(argv)
+
+    server = StubServer(latency=args.latency, jitter=args.jitter, error_rate=args.error_rate, fixtures=load_fixtures(args.fixtures)).start()
+    try:
+        app = import_app(server)
+        results = run_benchmarks(app, server, args.sizes, args.filter_sizes, args.repeat)
+    finally:
+        server.stop()
+
+    print_report(results, server)
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump(results, f, indent=2)
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.tolerance, args.noise_floor)
+        for name, before, after in regressions:
+            print(f"REGRESSION {name}: {before * 1000:.2f} ms -> {after * 1000:.2f} ms")
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
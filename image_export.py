@@ -0,0 +1,173 @@
+"""Export selected images: full-resolution downloads, crops and a manifest.
+
+Downloads run on a thread pool and stream to ``<name>.part`` files in
+chunks; an interrupted download resumes with an HTTP Range request. Each
+finished original is handed to a process pool that cuts the configured
+portrait/landscape renditions with Pillow, so cropping runs while other
+downloads are still in flight. ``manifest.json`` lists every item with its
+attribution and output files.
+
+The app calls ``export_selection`` from its export panel; a campaign batch
+can be exported from the command line:
+
+    python image_export.py selection.json --output export/
+
+where ``selection.json`` is a list of items with ``slot``, ``url``,
+``orientation`` and optionally ``id``, ``provider``, ``description`` and
+``attribution``.
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+
+import requests
+from PIL import Image, ImageOps
+from requests.adapters import HTTPAdapter
+
+# "orientation=WxH,WxH;orientation=WxH": crop sizes produced for each selected image
+DEFAULT_RENDITIONS = "portrait=1080x1920,720x1280;landscape=1920x1080,1200x628"
+CHUNK_SIZE = 256 * 1024
+MANIFEST = "manifest.json"
+
+
+def parse_renditions(spec):
+    """{"portrait": [(1080, 1920), ...], "landscape": [...]} from the EXPORT_RENDITIONS format."""
+    renditions = {}
+    for part in spec.split(";"):
+        if "=" not in part:
+            continue
+        orientation, sizes = part.split("=", 1)
+        renditions[orientation.strip()] = [
+            tuple(int(n) for n in size.lower().split("x")) for size in sizes.split(",") if size.strip()
+        ]
+    return renditions
+
+
+def make_session(pool_size):
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+def download(session, url, path, attempts=3, timeout=(5, 60)):
+    """Stream ``url`` to ``path``; a partial ``.part`` file is resumed with a Range request."""
+    if os.path.exists(path):
+        return os.path.getsize(path)
+    part = f"{path}.part"
+    for attempt in range(1, attempts + 1):
+        offset = os.path.getsize(part) if os.path.exists(part) else 0
+        headers = {"Range": f"bytes={offset}-"} if offset else {}
+        try:
+            with session.get(url, headers=headers, stream=True, timeout=timeout) as response:
+                if response.status_code == 416:  # already complete
+                    break
+                response.raise_for_status()
+                # A server that ignores Range sends the whole file again
+                mode = "ab" if offset and response.status_code == 206 else "wb"
+                with open(part, mode) as f:
+                    for chunk in response.iter_content(CHUNK_SIZE):
+                        f.write(chunk)
+            break
+        except requests.RequestException:
+            if attempt == attempts:
+                raise
+            time.sleep(2 ** attempt / 4)
+    os.replace(part, path)
+    return os.path.getsize(path)
+
+
+def render_crops(source, out_dir, stem, sizes, quality=90):
+    """Center-crop ``source`` to each (width, height) in ``sizes``; runs in a worker process."""
+    files = []
+    with Image.open(source) as image:
+        image = ImageOps.exif_transpose(image).convert("RGB")
+        for width, height in sizes:
+            name = f"{stem}_{width}x{height}.jpg"
+            ImageOps.fit(image, (width, height), Image.LANCZOS).save(
+                os.path.join(out_dir, name), format="JPEG", quality=quality, optimize=True
+            )
+            files.append(name)
+    return files
+
+
+def entry_stem(entry):
+    slot = "".join(c if c.isalnum() else "-" for c in entry.get("slot") or "image")
+    image_id = "".join(c if c.isalnum() else "-" for c in str(entry.get("id") or "")) or "x"
+    return f"{slot}_{entry.get('provider') or 'image'}_{image_id}"
+
+
+def export_selection(items, out_dir, renditions=None, download_workers=8, crop_processes=None):
+    """Download, crop and describe ``items``; returns the manifest written to ``out_dir``."""
+    renditions = renditions or parse_renditions(DEFAULT_RENDITIONS)
+    originals_dir = os.path.join(out_dir, "originals")
+    os.makedirs(originals_dir, exist_ok=True)
+    session = make_session(download_workers)
+    entries = [dict(item, files=[], error=None) for item in items]
+
+    # Spawned rather than forked from the (threaded) Streamlit server. Spawned workers re-import the
+    # parent's __main__ as __mp_main__, which under `streamlit run` is the app script itself: its
+    # imports and config load in every worker (main() is guarded), so expect a slower first export
+    context = multiprocessing.get_context("spawn")
+    with ThreadPoolExecutor(max_workers=download_workers) as downloads, \
+            ProcessPoolExecutor(max_workers=crop_processes or min(os.cpu_count() or 1, max(1, len(entries))), mp_context=context) as crops:
+        pending = {}
+        for entry in entries:
+            stem = entry_stem(entry)
+            entry["original"] = os.path.join("originals", f"{stem}.jpg")
+            path = os.path.join(out_dir, entry["original"])
+            pending[downloads.submit(download, session, entry["url"], path)] = entry
+        crop_jobs = {}
+        for future in as_completed(pending):
+            entry = pending[future]
+            try:
+                entry["bytes"] = future.result()
+            except Exception as e:
+                entry["error"] = f"download failed: {e}"
+                continue
+            sizes = renditions.get(entry.get("orientation"), [])
+            source = os.path.join(out_dir, entry["original"])
+            crop_jobs[crops.submit(render_crops, source, out_dir, entry_stem(entry), sizes)] = entry
+        for future in as_completed(crop_jobs):
+            entry = crop_jobs[future]
+            try:
+                entry["files"] = future.result()
+            except Exception as e:
+                entry["error"] = f"crop failed: {e}"
+
+    manifest = {"exported_at": time.strftime("%Y-%m-%dT%H:%M:%S"), "items": entries}
+    with open(os.path.join(out_dir, MANIFEST), "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2)
+    return manifest
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("selection", help="JSON list of items (slot, url, orientation, ...)")
+    parser.add_argument("--output", required=True, help="export directory (created if missing)")
+    parser.add_argument("--renditions", default=os.getenv("EXPORT_RENDITIONS", DEFAULT_RENDITIONS))
+    parser.add_argument("--download-workers", type=int, default=8)
+    parser.add_argument("--crop-processes", type=int, default=None, help="default: one per CPU")
+    args = parser.parse_args(argv)
+
+    with open(args.selection, encoding="utf-8") as f:
+        items = json.load(f)
+    started = time.time()
+    manifest = export_selection(
+        items, args.output, parse_renditions(args.renditions),
+        download_workers=args.download_workers, crop_processes=args.crop_processes,
+    )
+    failures = [item for item in manifest["items"] if item["error"]]
+    for item in failures:
+        print(f"{item['slot']}: {item['error']}")
+    print(f"exported {len(manifest['items']) - len(failures)}/{len(manifest['items'])} images in {time.time() - started:.1f}s")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,282 @@
+"""Multi-session load test for the Streamlit app.
+
+Drives simulated editor sessions through the app with Streamlit's
+in-process ``AppTest`` runner against the local Getty/Unsplash stub from
+``bench_search.py``: load, search a city, page, select, search two
+highlights. Each concurrency level runs that many sessions at once and
+reports step latency percentiles (a step lasts until the searches it
+started have finished, polling like the browser does), script reruns per
+second and the resident memory each session added, so a pod can be sized
+before real editors find the limit.
+
+    python load_test.py                              # levels 1,2,4,8
+    python load_test.py --concurrency 1,4,16,32 --sessions-per-level 2
+    python load_test.py --latency 0.3 --source "Getty + Unsplash" --save load.json
+
+Every level starts with cold caches unless ``--warm`` is given, so a level's
+RSS growth per session includes its share of the caches it filled (and
+the first level the app's imports). The
+memory retained by a session alone is measured separately afterwards
+(``--memory-sessions``) with tracemalloc, so tracing does not distort the
+latency numbers.
+"""
+import argparse
+import gc
+import json
+import os
+import resource
+import sys
+import tempfile
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+
+from bench_search import StubServer, load_fixtures
+
+APP_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "unsplash_images_app.py")
+# Search panel keys in the app; a panel's "<key>_job" is set while its search runs
+PANEL_KEYS = ("city", "attraction", "attraction2")
+POLL_INTERVAL = float(os.getenv("SEARCH_POLL_INTERVAL", "0.25"))
+
+
+def percentile(values, q):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(q * (len(values) - 1))))]
+
+
+def peak_rss_mb():
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    scale = 1024 * 1024 if sys.platform == "darwin" else 1024
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / scale
+
+
+def current_rss_mb():
+    """Resident memory now; falls back to the lifetime peak where /proc is missing."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / (1024 * 1024)
+    except OSError:
+        return peak_rss_mb()
+
+
+def run_session(index, args):
+    """One editor session; returns ([(step, seconds)], error or None, AppTest, script runs)."""
+    from streamlit.testing.v1 import AppTest
+
+    city = args.cities[index % len(args.cities)]
+    at = AppTest.from_file(APP_PATH, default_timeout=args.timeout)
+    timings = []
+    runs = [0]
+
+    def settle():
+        # The browser reruns panels with a running search (run_every); AppTest has no browser
+        deadline = time.perf_counter() + args.timeout
+        while time.perf_counter() < deadline and any(
+            f"{key}_job" in at.session_state and at.session_state[f"{key}_job"] is not None for key in PANEL_KEYS
+        ):
+            time.sleep(POLL_INTERVAL)
+            at.run()
+            runs[0] += 1
+
+    def step(name, action):
+        started = time.perf_counter()
+        action()
+        runs[0] += 1
+        settle()
+        timings.append((name, time.perf_counter() - started))
+        if at.exception:
+            raise RuntimeError(f"{name}: {at.exception[0].message}")
+        if args.think_time:
+            time.sleep(args.think_time)
+
+    def select_first():
+        buttons = [b for b in at.button if b.key and b.key.startswith("select_city_page")]
+        if buttons:
+            buttons[0].click().run()
+
+    try:
+        step("load", at.run)
+        if args.source:
+            step("choose_source", lambda: at.radio[0].set_value(args.source).run())
+        step("search_city", lambda: at.text_input(key="city_input_value").set_value(city).run())
+        for _ in range(args.pages):
+            step("next_page", lambda: at.button(key="city_next").click().run())
+        step("select", select_first)
+        for key, attraction in zip(("attraction_input_value", "attraction2_input_value"), args.attractions):
+            step("search_attraction", lambda key=key, attraction=attraction: at.text_input(key=key).set_value(attraction).run())
+        return timings, None, at, runs[0]
+    except Exception as e:
+        return timings, str(e), at, runs[0]
+
+
+def share_test_runtime():
+    """Let AppTest sessions run concurrently in one process.
+
+    Each ``AppTest.run`` installs a mock Runtime and the ``global.appTest``
+    option, then clears both when it finishes, which would pull them out
+    from under sessions still running in other threads. Keep the option set
+    and fall back to the last installed runtime instead. Every run also gets
+    a private ScriptCache, and compiling the script from several threads at
+    once breaks CPython's parser; share one cache like the real server does.
+    """
+    from streamlit import config
+    from streamlit.runtime.runtime import Runtime
+    from streamlit.runtime.scriptrunner.script_cache import ScriptCache
+    from streamlit.testing.v1 import local_script_runner
+
+    script_cache = ScriptCache()
+    local_script_runner.ScriptCache = lambda: script_cache
+
+    config.set_option("global.appTest", True)
+    last = []
+
+    def instance(cls):
+        if cls._instance is not None:
+            last[:] = [cls._instance]
+            return cls._instance
+        if last:
+            return last[0]
+        raise RuntimeError("Runtime hasn't been created!")
+
+    Runtime.instance = classmethod(instance)
+    Runtime.exists = classmethod(lambda cls: cls._instance is not None or bool(last))
+
+
+def reset_shared_state(scratch, level):
+    """Fresh search/image caches for a cold level (the app reads these paths on every run)."""
+    import streamlit as st
+
+    os.environ["SEARCH_CACHE_PATH"] = os.path.join(scratch, f"search_cache_{level}.sqlite3")
+    os.environ["IMAGE_CACHE_DIR"] = os.path.join(scratch, f"images_{level}")
+    os.environ["QUERY_LOG_PATH"] = os.path.join(scratch, f"query_log_{level}.jsonl")
+    st.cache_resource.clear()
+
+
+def run_level(concurrency, args, server):
+    state = server.state
+    state.reset_counters()
+    sessions = concurrency * args.sessions_per_level
+    gc.collect()
+    rss_before = current_rss_mb()
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(lambda i: run_session(i, args), range(sessions)))
+    wall = time.perf_counter() - started
+    # Measured while the level's AppTest sessions are still referenced by ``results``
+    gc.collect()
+    rss_growth = current_rss_mb() - rss_before
+
+    latencies = [seconds for timings, _, _, _ in results for _, seconds in timings]
+    by_step = {}
+    for timings, _, _, _ in results:
+        for name, seconds in timings:
+            by_step.setdefault(name, []).append(seconds)
+    errors = [error for _, error, _, _ in results if error]
+    reruns = sum(runs for _, _, _, runs in results)
+    return {
+        "concurrency": concurrency,
+        "sessions": sessions,
+        "steps": len(latencies),
+        "reruns": reruns,
+        "errors": len(errors),
+        "first_error": errors[0] if errors else None,
+        "wall_s": wall,
+        "reruns_per_s": reruns / wall if wall else 0.0,
+        "sessions_per_min": sessions / wall * 60 if wall else 0.0,
+        "p50_ms": percentile(latencies, 0.50) * 1000,
+        "p95_ms": percentile(latencies, 0.95) * 1000,
+        "p99_ms": percentile(latencies, 0.99) * 1000,
+        "max_ms": max(latencies, default=0.0) * 1000,
+        "step_p95_ms": {name: percentile(values, 0.95) * 1000 for name, values in by_step.items()},
+        "upstream_requests": state.total_requests("getty/search") + state.total_requests("unsplash/search"),
+        "rss_growth_mb": rss_growth,
+        "rss_kb_per_session": rss_growth * 1024 / sessions,
+        "peak_rss_mb": peak_rss_mb(),
+    }
+
+
+def measure_session_memory(args, count):
+    """Average traced memory retained per finished session, with shared caches already warm."""
+    run_session(0, args)  # warm the caches shared by all sessions
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    kept = [run_session(i, args)[2] for i in range(count)]
+    gc.collect()
+    after, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del kept
+    return {"sessions": count, "retained_kb_per_session": (after - before) / count / 1024, "peak_kb": (peak - before) / 1024}
+
+
+def print_report(levels, memory):
+    print(f"{'sessions':>8} {'conc':>5} {'reruns':>7} {'err':>4} {'rerun/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'max ms':>8} {'upstream':>9} {'KB/sess':>8}")
+    for r in levels:
+        print(
+            f"{r['sessions']:>8} {r['concurrency']:>5} {r['reruns']:>7} {r['errors']:>4} {r['reruns_per_s']:>8.1f} "
+            f"{r['p50_ms']:>8.0f} {r['p95_ms']:>8.0f} {r['p99_ms']:>8.0f} {r['max_ms']:>8.0f} {r['upstream_requests']:>9} {r['rss_kb_per_session']:>8.0f}"
+        )
+    for r in levels:
+        if r["first_error"]:
+            print(f"concurrency {r['concurrency']}: {r['errors']} failed sessions, first: {r['first_error']}")
+    slowest = levels[-1]["step_p95_ms"] if levels else {}
+    if slowest:
+        print("\np95 by step at the highest level: " + ", ".join(f"{name} {ms:.0f} ms" for name, ms in slowest.items()))
+    if memory:
+        print(f"memory: {memory['retained_kb_per_session']:.0f} KB retained per session (peak {memory['peak_kb']:.0f} KB over {memory['sessions']} sessions)")
+
+
+def parse_list(value):
+    return [v.strip() for v in value.split(",") if v.strip()]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--concurrency", type=lambda v: [int(n) for n in parse_list(v)], default=[1, 2, 4, 8], help="concurrent sessions per level")
+    parser.add_argument("--sessions-per-level", type=int, default=1, help="sessions per concurrent slot, run back to back")
+    parser.add_argument("--cities", type=parse_list, default=["Paris", "Rome", "Amsterdam", "Lisbon", "Oslo", "Vienna"])
+    parser.add_argument("--attractions", type=parse_list, default=["Old Town", "Cathedral"])
+    parser.add_argument("--pages", type=int, default=2, help="result pages flipped per session")
+    parser.add_argument("--source", help='image source to pick first, e.g. "Getty + Unsplash"')
+    parser.add_argument("--think-time", type=float, default=0.0, help="pause between steps, seconds")
+    parser.add_argument("--timeout", type=float, default=60, help="per-rerun timeout, seconds")
+    parser.add_argument("--warm", action="store_true", help="keep caches between levels")
+    parser.add_argument("--memory-sessions", type=int, default=4, help="sessions for the memory pass (0 = skip)")
+    parser.add_argument("--latency", type=float, default=0.05, help="stub response latency, seconds")
+    parser.add_argument("--jitter", type=float, default=0.0, help="extra random latency, seconds")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of stub responses that are 503")
+    parser.add_argument("--fixtures", help="directory with recorded getty.json / unsplash.json responses")
+    parser.add_argument("--save", help="write results as JSON")
+    args = parser.parse_args(argv)
+
+    server = StubServer(latency=args.latency, jitter=args.jitter, error_rate=args.error_rate, fixtures=load_fixtures(args.fixtures)).start()
+    scratch = tempfile.mkdtemp(prefix="klm-load-")
+    os.environ.update(server.env())
+    os.environ.setdefault("STREAMLIT_LOGGER_LEVEL", "error")
+    os.environ.setdefault("EXPORT_DIR", os.path.join(scratch, "export"))
+    sys.path.insert(0, os.path.dirname(APP_PATH))
+    share_test_runtime()
+    levels, memory = [], None
+    try:
+        for n, concurrency in enumerate(args.concurrency):
+            if n == 0 or not args.warm:
+                reset_shared_state(scratch, n)
+            levels.append(run_level(concurrency, args, server))
+            print(f"concurrency {concurrency}: p95 {levels[-1]['p95_ms']:.0f} ms, {levels[-1]['errors']} errors", file=sys.stderr)
+        if args.memory_sessions:
+            reset_shared_state(scratch, "memory")
+            memory = measure_session_memory(args, args.memory_sessions)
+    finally:
+        server.stop()
+
+    print_report(levels, memory)
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump({"levels": levels, "memory": memory, "options": vars(args)}, f, indent=2)
+    return 1 if any(r["errors"] for r in levels) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
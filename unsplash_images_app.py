@@ -3,8 +3,35 @@ import requests
 from dotenv import load_dotenv
 import os
 import base64
+import functools
+import hashlib
+import heapq
+import io
 import urllib.parse
 import time
+import math
+import glob
+import re
+import json
+import shutil
+import sqlite3
+import threading
+import weakref
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from itertools import chain, compress, count
+from operator import attrgetter
+from typing import NamedTuple
+from concurrent.futures import ThreadPoolExecutor, wait
+import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
+from cachetools import TTLCache
+from PIL import Image
+from requests.adapters import HTTPAdapter
+from tenacity import Retrying, retry_if_exception_type, stop_after_attempt, wait_random_exponential
+from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
+import image_export
 
 
 
@@ -14,172 +41,2259 @@ client_secret = os.getenv("GETTY_CLIENT_SECRET")
 unsplash_access_key = os.getenv("UNSPLASH_ACCESS_KEY")
 unsplash_secret_key = os.getenv("UNSPLASH_SECRET_KEY")
 
-# Global variable to store access token
-access_token = None
-token_expiry = None
+# Provider endpoints (overridable to point the app at a local stub, e.g. for benchmarks)
+getty_auth_url = os.getenv("GETTY_AUTH_URL", "https://authentication.gettyimages.com/oauth2/token")
+getty_api_url = os.getenv("GETTY_API_URL", "https://api.gettyimages.com/v3")
+unsplash_api_url = os.getenv("UNSPLASH_API_URL", "https://api.unsplash.com")
+
+# Maximum number of result pages requested at the same time by fetch_many_images
+max_fetch_workers = int(os.getenv("MAX_FETCH_WORKERS", "6"))
+
+# Searching Getty and Unsplash together: overall deadline for one combined page
+fanout_deadline = float(os.getenv("FANOUT_DEADLINE", "8"))  # seconds
+
+# Image source choices offered in the UI
+provider_choices = {
+    "Unsplash": ("unsplash",),
+    "Getty": ("getty",),
+    "Getty + Unsplash": ("getty", "unsplash"),
+}
+provider_labels = {"getty": "Getty Images", "unsplash": "Unsplash"}
+
+# Metrics export for dashboards: a *.prom path is rewritten in Prometheus text format,
+# any other path gets JSONL snapshots appended, at most every METRICS_EXPORT_INTERVAL seconds
+metrics_export_path = os.getenv("METRICS_EXPORT_PATH")
+metrics_export_interval = float(os.getenv("METRICS_EXPORT_INTERVAL", "15"))
+
+# Search result cache: in-process LRU with a TTL in front of a persistent SQLite store
+search_cache_size = int(os.getenv("SEARCH_CACHE_SIZE", "512"))  # pages kept in memory
+search_cache_ttl = int(os.getenv("SEARCH_CACHE_TTL", "3600"))  # seconds
+search_cache_path = os.getenv("SEARCH_CACHE_PATH", ".cache/search_cache.sqlite3")
+search_cache_disk_ttl = int(os.getenv("SEARCH_CACHE_DISK_TTL", str(7 * 24 * 3600)))  # seconds
+search_cache_max_bytes = int(os.getenv("SEARCH_CACHE_MAX_BYTES", str(512 * 1024 * 1024)))
+
+# Shared HTTP client settings for Getty and Unsplash calls
+http_connect_timeout = float(os.getenv("HTTP_CONNECT_TIMEOUT", "3.05"))  # seconds
+http_read_timeout = float(os.getenv("HTTP_READ_TIMEOUT", "10"))  # seconds
+http_max_retries = int(os.getenv("HTTP_MAX_RETRIES", "3"))
+http_pool_size = int(os.getenv("HTTP_POOL_SIZE", "16"))  # keep-alive connections per provider
+
+# Upstream request scheduling: a token bucket per provider key (requests per hour,
+# 0 = no local limit) plus the quota the providers report in X-RateLimit headers.
+# Read-ahead and background work (speculative prefetch, batch jobs) leave the
+# *_RESERVE share of the quota to interactive searches and give up after waiting
+# UPSTREAM_MAX_WAIT_* seconds; searches then get cached or partial results
+getty_quota_per_hour = float(os.getenv("GETTY_QUOTA_PER_HOUR", "5000"))
+unsplash_quota_per_hour = float(os.getenv("UNSPLASH_QUOTA_PER_HOUR", "5000"))
+upstream_burst = int(os.getenv("UPSTREAM_BURST", "30"))  # requests
+upstream_reserve = {
+    "interactive": 0.0,
+    "read_ahead": float(os.getenv("UPSTREAM_READ_AHEAD_RESERVE", "0.1")),
+    "background": float(os.getenv("UPSTREAM_BACKGROUND_RESERVE", "0.3")),
+}
+upstream_max_wait = {
+    "interactive": float(os.getenv("UPSTREAM_MAX_WAIT_INTERACTIVE", "5")),  # seconds
+    "read_ahead": float(os.getenv("UPSTREAM_MAX_WAIT_READ_AHEAD", "0")),
+    "background": float(os.getenv("UPSTREAM_MAX_WAIT_BACKGROUND", "0")),
+}
+
+# Getty OAuth token refresh: tokens are treated as expired this many seconds early,
+# and refreshed in the background this many seconds before that
+token_expiry_margin = int(os.getenv("GETTY_TOKEN_EXPIRY_MARGIN", "60"))
+token_refresh_lead = int(os.getenv("GETTY_TOKEN_REFRESH_LEAD", "120"))
+
+# Result panels load upstream pages lazily: this many thumbnail pages are kept
+# loaded beyond the one on screen, fetching LAZY_PAGE_SIZE results per request
+read_ahead_pages = int(os.getenv("READ_AHEAD_PAGES", "2"))
+lazy_page_size = int(os.getenv("LAZY_PAGE_SIZE", "30"))
+
+# Panel searches run in the background. Typed queries wait SEARCH_DEBOUNCE
+# seconds before calling upstream, and a newer search in the same panel cancels
+# the older one; the panel checks for results every SEARCH_POLL_INTERVAL seconds
+search_debounce = float(os.getenv("SEARCH_DEBOUNCE", "0.6"))  # seconds
+search_poll_interval = float(os.getenv("SEARCH_POLL_INTERVAL", "0.25"))  # seconds
+
+# After a city search, the likely highlight searches for that city are run in the
+# background to warm the search cache: PREFETCH_ATTRACTIONS is a JSON file mapping
+# city -> attractions, topped up from the query log of past highlight searches
+query_log_path = os.getenv("QUERY_LOG_PATH", ".cache/query_log.jsonl")
+prefetch_attractions_path = os.getenv("PREFETCH_ATTRACTIONS", "")
+prefetch_per_city = int(os.getenv("PREFETCH_PER_CITY", "3"))  # 0 disables prefetching
+prefetch_budget = float(os.getenv("PREFETCH_BUDGET", "300"))  # upstream requests per hour
+
+# Keep the raw provider payloads in session_state as *_debug (off by default: they are large)
+keep_debug_payloads = os.getenv("KEEP_DEBUG_PAYLOADS", "0") == "1"
+
+# Parquet index written by batch_index.py; matching searches are served from it without upstream calls
+precomputed_index_path = os.getenv("PRECOMPUTED_INDEX")
+
+# Content filter: comma-separated EXCLUDE_KEYWORDS overrides the default list below,
+# PANEL_CONTENT_FILTER=1 also applies it to the result panels (not just filter_images)
+default_exclude_keywords = [
+    'person', 'people', 'man', 'men', 'woman', 'women', 'boy', 'girl', 'logo', 'brand',
+    'advertisement', 'company', 'corporate', 'sign', 'trademark', 'product',
+    'face', 'group'
+]
+exclude_keywords = [k.strip().lower() for k in os.getenv("EXCLUDE_KEYWORDS", "").split(",") if k.strip()] or default_exclude_keywords
+panel_content_filter = os.getenv("PANEL_CONTENT_FILTER", "0") == "1"
+
+# Local cache of downscaled thumbnails and previews served to st.image
+image_cache_dir = os.getenv("IMAGE_CACHE_DIR", ".cache/images")
+image_cache_max_bytes = int(os.getenv("IMAGE_CACHE_MAX_BYTES", str(1024 * 1024 * 1024)))
+image_prefetch_workers = int(os.getenv("IMAGE_PREFETCH_WORKERS", "4"))
+thumb_display_size = int(os.getenv("THUMB_DISPLAY_SIZE", "400"))  # longest side, pixels
+preview_display_size = int(os.getenv("PREVIEW_DISPLAY_SIZE", "800"))  # longest side, pixels
+# Show the cached thumbnail first and swap in the preview once it has loaded
+progressive_preview = os.getenv("PROGRESSIVE_PREVIEW", "1") == "1"
+
+# Near-identical results (re-uploads, the same shot on several pages or from both
+# providers) are collapsed by comparing 64-bit difference hashes of their thumbnails;
+# DEDUP_MAX_DISTANCE is the most bits two hashes may differ by and still be the same image
+dedup_results = os.getenv("DEDUP_RESULTS", "1") == "1"
+dedup_max_distance = int(os.getenv("DEDUP_MAX_DISTANCE", "6"))
+dedup_workers = int(os.getenv("DEDUP_WORKERS", "8"))  # thumbnails loaded at the same time
+phash_cache_size = int(os.getenv("PHASH_CACHE_SIZE", "50000"))  # hashes kept in memory
+
+# Export of the selected images: one timestamped folder per export under EXPORT_DIR
+export_dir = os.getenv("EXPORT_DIR", "export")
+export_renditions = os.getenv("EXPORT_RENDITIONS", image_export.DEFAULT_RENDITIONS)
+export_download_workers = int(os.getenv("EXPORT_DOWNLOAD_WORKERS", "8"))
+
+class Metrics:
+    """Process-wide timing spans, counters and gauges for the search hot path.
+
+    Every series is keyed by name plus labels. Spans keep count/sum/max and
+    a window of recent durations for percentiles; ``to_prometheus`` and
+    ``to_jsonl`` render the current values for export, which
+    ``start_exporter`` writes out periodically from a background thread.
+    """
+
+    prefix = "klm_image_search"
+
+    def __init__(self, window=1000):
+        self.window = window
+        self.started = time.time()
+        self.last_export = 0.0
+        self.spans = {}
+        self.counters = {}
+        self.gauges = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(name, labels):
+        return name, tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+    @contextmanager
+    def span(self, name, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    def observe(self, name, seconds, **labels):
+        key = self._key(name, labels)
+        with self._lock:
+            span = self.spans.get(key)
+            if span is None:
+                span = self.spans[key] = {"count": 0, "sum": 0.0, "max": 0.0, "recent": deque(maxlen=self.window)}
+            span["count"] += 1
+            span["sum"] += seconds
+            span["max"] = max(span["max"], seconds)
+            span["recent"].append(seconds)
+
+    def inc(self, name, value=1, **labels):
+        key = self._key(name, labels)
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def set_gauge(self, name, value, **labels):
+        with self._lock:
+            self.gauges[self._key(name, labels)] = value
+
+    def snapshot(self):
+        """List of series dicts: {"type", "name", "labels", ...values}."""
+        rows = []
+        with self._lock:
+            for (name, labels), span in sorted(self.spans.items()):
+                recent = sorted(span["recent"])
+                rows.append({
+                    "type": "span", "name": name, "labels": dict(labels),
+                    "count": span["count"], "sum": span["sum"], "max": span["max"],
+                    "p50": recent[len(recent) // 2] if recent else 0.0,
+                    "p95": recent[min(len(recent) - 1, int(len(recent) * 0.95))] if recent else 0.0,
+                })
+            for (name, labels), value in sorted(self.counters.items()):
+                rows.append({"type": "counter", "name": name, "labels": dict(labels), "value": value})
+            for (name, labels), value in sorted(self.gauges.items()):
+                rows.append({"type": "gauge", "name": name, "labels": dict(labels), "value": value})
+        return rows
+
+    def to_prometheus(self):
+        lines = []
+        declared = set()
+
+        def declare(metric, kind):
+            if metric not in declared:
+                declared.add(metric)
+                lines.append(f"# TYPE {metric} {kind}")
+
+        for row in self.snapshot():
+            labels = row["labels"]
+            if row["type"] == "span":
+                metric = f"{self.prefix}_span_seconds"
+                declare(metric, "summary")
+                base = dict(labels, span=row["name"])
+                for quantile in ("0.5", "0.95"):
+                    value = row["p50"] if quantile == "0.5" else row["p95"]
+                    lines.append(f"{metric}{_prometheus_labels(dict(base, quantile=quantile))} {value:.6f}")
+                lines.append(f"{metric}_sum{_prometheus_labels(base)} {row['sum']:.6f}")
+                lines.append(f"{metric}_count{_prometheus_labels(base)} {row['count']}")
+            elif row["type"] == "counter":
+                metric = f"{self.prefix}_{row['name']}_total"
+                declare(metric, "counter")
+                lines.append(f"{metric}{_prometheus_labels(labels)} {row['value']}")
+            else:
+                metric = f"{self.prefix}_{row['name']}"
+                declare(metric, "gauge")
+                lines.append(f"{metric}{_prometheus_labels(labels)} {row['value']}")
+        return "\n".join(lines) + "\n"
+
+    def to_jsonl(self):
+        timestamp = time.time()
+        return "".join(json.dumps(dict(row, ts=timestamp)) + "\n" for row in self.snapshot())
+
+    def export(self, path, interval=0.0):
+        """Write to ``path`` (Prometheus text for *.prom, else appended JSONL) unless exported recently."""
+        now = time.time()
+        with self._lock:
+            if now - self.last_export < interval:
+                return False
+            self.last_export = now
+        if path.endswith(".prom"):
+            tmp_path = f"{path}.tmp"
+            with open(tmp_path, "w") as f:
+                f.write(self.to_prometheus())
+            os.replace(tmp_path, path)
+        else:
+            with open(path, "a") as f:
+                f.write(self.to_jsonl())
+        return True
+
+    def start_exporter(self, path, interval):
+        """Export to ``path`` every ``interval`` seconds, independent of script reruns.
+
+        The thread only holds a weak reference and stops once this registry
+        is released, e.g. when clearing the resource cache replaces it.
+        """
+        interval = max(interval, 1.0)
+        ref = weakref.ref(self)
+
+        def run():
+            while True:
+                time.sleep(interval)
+                metrics = ref()
+                if metrics is None:
+                    return
+                try:
+                    metrics.export(path)
+                except OSError:
+                    metrics.inc("metrics_export_errors")
+                del metrics
+
+        threading.Thread(target=run, name="metrics-export", daemon=True).start()
+
+
+def _prometheus_labels(labels):
+    if not labels:
+        return ""
+    escaped = (str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for v in labels.values())
+    return "{" + ",".join(f'{k}="{v}"' for k, v in zip(labels, escaped)) + "}"
+
+
+# Shared by every session of this Streamlit process
+@st.cache_resource(show_spinner=False)
+def get_metrics():
+    metrics = Metrics()
+    if metrics_export_path:
+        # Fragment reruns never reach the end of main(), so export on a timer
+        metrics.start_exporter(metrics_export_path, metrics_export_interval)
+    return metrics
+
+def timed(name):
+    """Decorator recording each call of the function as a metrics span."""
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with get_metrics().span(name):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+class RateLimiter:
+    """Token bucket allowing ``rate`` requests per second with bursts of ``capacity``."""
+
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity or max(1.0, rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """Block until a request may be sent."""
+        while True:
+            with self._lock:
+                self._refill()
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait_time = (1 - self.tokens) / self.rate
+            time.sleep(wait_time)
+
+    def try_acquire(self, tokens=1):
+        """Take ``tokens`` if they are available right now; never blocks."""
+        with self._lock:
+            self._refill()
+            if self.tokens >= tokens:
+                self.tokens -= tokens
+                return True
+            return False
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+
+class RetryableResponse(Exception):
+    """Raised for 429/5xx responses so tenacity retries them."""
+
+    def __init__(self, response):
+        super().__init__(f"HTTP {response.status_code}")
+        self.response = response
+
+
+class ProviderClient:
+    """Keep-alive HTTP session for one image provider.
+
+    Requests get connect/read timeouts, 429/5xx responses and connection
+    errors are retried with jittered exponential backoff (honouring
+    Retry-After), and the latency of every attempt is recorded.
+    """
+
+    retry_statuses = {429, 500, 502, 503, 504}
+
+    def __init__(self, name, pool_size=16, timeout=(3.05, 10), max_retries=3):
+        self.name = name
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_size)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self.latencies = deque(maxlen=1000)
+        self.counters = {"requests": 0, "retries": 0, "errors": 0}
+        # Optional RateLimiter applied to every attempt (set by batch jobs to stay under quota)
+        self.limiter = None
+        self._lock = threading.Lock()
+
+    def get(self, url, **kwargs):
+        return self.request("GET", url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request("POST", url, **kwargs)
+
+    def request(self, method, url, priority=None, **kwargs):
+        """Send a request with retries; the last 429/5xx response is returned, not raised.
+
+        With a ``priority`` every attempt, retries included, is admitted by the
+        UpstreamScheduler, so each attempt waits at most that priority's
+        ``max_wait`` for admission (UpstreamDeferred after that).
+        """
+        kwargs.setdefault("timeout", self.timeout)
+        retrying = Retrying(
+            stop=stop_after_attempt(self.max_retries + 1),
+            wait=self._backoff,
+            retry=retry_if_exception_type((RetryableResponse, requests.ConnectionError, requests.Timeout)),
+            before_sleep=self._count_retry,
+            reraise=True,
+        )
+        try:
+            return retrying(self._send, method, url, priority=priority, **kwargs)
+        except RetryableResponse as e:
+            return e.response
+
+    def _send(self, method, url, priority=None, **kwargs):
+        if priority is not None:
+            get_upstream_scheduler().acquire(self.name, priority)
+        if self.limiter is not None:
+            self.limiter.acquire()
+        start = time.perf_counter()
+        try:
+            response = self.session.request(method, url, **kwargs)
+        except requests.RequestException as e:
+            self._record(time.perf_counter() - start, error=True)
+            get_metrics().inc("http_requests", provider=self.name, status=type(e).__name__)
+            raise
+        self._record(time.perf_counter() - start, error=response.status_code >= 400)
+        self._record_response(response)
+        if response.status_code in self.retry_statuses:
+            raise RetryableResponse(response)
+        return response
+
+    @staticmethod
+    def _backoff(retry_state):
+        exc = retry_state.outcome.exception()
+        if isinstance(exc, RetryableResponse):
+            retry_after = exc.response.headers.get("Retry-After", "")
+            if retry_after.isdigit():
+                # Scheduled requests wait out the provider's pause (see _record_response) in acquire
+                return 0 if retry_state.kwargs.get("priority") else min(float(retry_after), 30.0)
+        return wait_random_exponential(multiplier=0.5, max=8)(retry_state)
+
+    def _count_retry(self, retry_state):
+        with self._lock:
+            self.counters["retries"] += 1
+
+    def _record(self, elapsed, error=False):
+        with self._lock:
+            self.latencies.append(elapsed)
+            self.counters["requests"] += 1
+            if error:
+                self.counters["errors"] += 1
+        get_metrics().observe("http_request", elapsed, provider=self.name)
+
+    def _record_response(self, response):
+        metrics = get_metrics()
+        metrics.inc("http_requests", provider=self.name, status=response.status_code)
+        metrics.inc("http_bytes", len(response.content), provider=self.name)
+        quota = {}
+        for header, gauge in (("X-RateLimit-Remaining", "ratelimit_remaining"), ("X-RateLimit-Limit", "ratelimit_limit")):
+            value = response.headers.get(header, "")
+            if value.isdigit():
+                metrics.set_gauge(gauge, int(value), provider=self.name)
+                quota[gauge] = int(value)
+        scheduler = get_upstream_scheduler()
+        if len(quota) == 2:
+            scheduler.record_quota(self.name, quota["ratelimit_remaining"], quota["ratelimit_limit"])
+        retry_after = response.headers.get("Retry-After", "")
+        if response.status_code == 429 and retry_after.isdigit():
+            scheduler.pause(self.name, float(retry_after))
+
+    def stats(self):
+        """Request counters plus latency percentiles (seconds) over recent calls."""
+        with self._lock:
+            stats = dict(self.counters)
+            latencies = sorted(self.latencies)
+        if latencies:
+            stats["p50"] = latencies[len(latencies) // 2]
+            stats["p95"] = latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))]
+            stats["mean"] = sum(latencies) / len(latencies)
+        return stats
+
+
+# One pooled client per provider, shared by every session of this Streamlit process
+@st.cache_resource(show_spinner=False)
+def get_provider_client(name):
+    return ProviderClient(
+        name,
+        pool_size=http_pool_size,
+        timeout=(http_connect_timeout, http_read_timeout),
+        max_retries=http_max_retries,
+    )
+
+class UpstreamDeferred(Exception):
+    """Raised when the scheduler does not admit a request within its priority's wait."""
 
+    def __init__(self, provider, priority):
+        super().__init__(f"{provider_labels.get(provider, provider)} request deferred ({priority}): API quota is reserved")
+        self.provider = provider
+        self.priority = priority
+
+
+class SearchFailed(Exception):
+    """Raised by ``fetch_many_images(strict=True)`` when an upstream page request failed."""
+
+
+class UpstreamScheduler:
+    """Admits upstream search requests per provider, most urgent first.
+
+    Every provider has a token bucket sized to its hourly quota, and the
+    remaining quota reported in X-RateLimit headers is tracked as responses
+    arrive. Waiting requests are served in ``priorities`` order, oldest first
+    within a priority. Lower priorities only get a token while more than their
+    ``reserve`` share of the bucket and of the reported quota is left, so
+    background work cannot use up what interactive searches need. A request
+    not admitted within ``max_wait`` seconds for its priority (None waits
+    indefinitely) raises UpstreamDeferred.
+    """
+
+    priorities = ("interactive", "read_ahead", "background")
+
+    def __init__(self, per_hour, burst=30, reserve=None, max_wait=None, quota_window=3600):
+        self.buckets = {
+            provider: RateLimiter(rate / 3600, capacity=max(1, min(rate, burst)))
+            for provider, rate in per_hour.items() if rate > 0
+        }
+        self.reserve = dict(reserve or {})
+        self.max_wait = dict(max_wait or {})
+        self.quota_window = quota_window
+        self.quota = {}  # provider -> (remaining, limit, monotonic time reported)
+        self.paused_until = {}
+        self.waiting = {}  # provider -> heap of (priority rank, arrival)
+        self._arrivals = count()
+        self._cond = threading.Condition()
+
+    def acquire(self, provider, priority="interactive"):
+        """Block until a request may be sent; raises UpstreamDeferred after ``max_wait``."""
+        started = time.monotonic()
+        max_wait = self.max_wait.get(priority)
+        deadline = None if max_wait is None else started + max_wait
+        with self._cond:
+            ticket = (self.priorities.index(priority), next(self._arrivals))
+            waiting = self.waiting.setdefault(provider, [])
+            heapq.heappush(waiting, ticket)
+            try:
+                while True:
+                    now = time.monotonic()
+                    # Only the most urgent waiter may take a token, the others wait their turn
+                    delay = self._admit_delay(provider, priority, now) if waiting[0] == ticket else None
+                    if delay == 0:
+                        self._take(provider)
+                        break
+                    if deadline is not None and now >= deadline:
+                        get_metrics().inc("upstream_requests", provider=provider, priority=priority, result="deferred")
+                        raise UpstreamDeferred(provider, priority)
+                    timeouts = [t for t in (delay, None if deadline is None else deadline - now) if t is not None]
+                    self._cond.wait(min(timeouts) if timeouts else None)
+            finally:
+                waiting.remove(ticket)
+                heapq.heapify(waiting)
+                self._cond.notify_all()
+        get_metrics().inc("upstream_requests", provider=provider, priority=priority, result="admitted")
+        get_metrics().observe("upstream_wait", time.monotonic() - started, provider=provider, priority=priority)
+
+    def _admit_delay(self, provider, priority, now):
+        """Seconds until a request of ``priority`` may be sent, 0 if it may go now."""
+        paused = self.paused_until.get(provider, 0) - now
+        if paused > 0:
+            return paused
+        reserve = self.reserve.get(priority, 0.0)
+        quota = self.quota.get(provider)
+        if quota is not None and now - quota[2] < self.quota_window and quota[0] <= reserve * quota[1]:
+            # Nothing left for this priority until the provider's window rolls over
+            return quota[2] + self.quota_window - now
+        bucket = self.buckets.get(provider)
+        if bucket is None:
+            return 0
+        bucket._refill()
+        floor = min(bucket.capacity, 1 + reserve * bucket.capacity)
+        return 0 if bucket.tokens >= floor else (floor - bucket.tokens) / bucket.rate
+
+    def _take(self, provider):
+        bucket = self.buckets.get(provider)
+        if bucket is not None:
+            bucket.tokens -= 1
+        quota = self.quota.get(provider)
+        if quota is not None:
+            # Count the request against the reported quota until the next header arrives
+            self.quota[provider] = (quota[0] - 1, quota[1], quota[2])
+
+    def record_quota(self, provider, remaining, limit):
+        """Quota from a provider's X-RateLimit-Remaining / X-RateLimit-Limit headers."""
+        with self._cond:
+            self.quota[provider] = (remaining, limit, time.monotonic())
+            self._cond.notify_all()
+
+    def pause(self, provider, seconds):
+        """Hold every request to ``provider`` back, e.g. for a 429's Retry-After."""
+        with self._cond:
+            self.paused_until[provider] = max(self.paused_until.get(provider, 0), time.monotonic() + seconds)
+            self._cond.notify_all()
+
+    def stats(self):
+        """Per provider: bucket tokens, reported quota and requests waiting."""
+        now = time.monotonic()
+        with self._cond:
+            stats = {}
+            for provider in sorted(set(self.buckets) | set(self.quota) | set(self.waiting)):
+                bucket = self.buckets.get(provider)
+                if bucket is not None:
+                    bucket._refill()
+                quota = self.quota.get(provider)
+                fresh = quota is not None and now - quota[2] < self.quota_window
+                stats[provider] = {
+                    "tokens": bucket.tokens if bucket is not None else None,
+                    "remaining": quota[0] if fresh else None,
+                    "limit": quota[1] if fresh else None,
+                    "waiting": len(self.waiting.get(provider, ())),
+                }
+            return stats
+
+# Shared by every session of this Streamlit process, so all editors draw on the same quota
+@st.cache_resource(show_spinner=False)
+def get_upstream_scheduler():
+    return UpstreamScheduler(
+        {"getty": getty_quota_per_hour, "unsplash": unsplash_quota_per_hour},
+        burst=upstream_burst,
+        reserve=upstream_reserve,
+        max_wait=upstream_max_wait,
+    )
+
+class GettyTokenManager:
+    """Process-wide Getty OAuth2 client-credentials token.
+
+    Refreshes are single-flight: concurrent callers that find the token
+    expired wait on one lock and reuse whatever the first caller fetched.
+    A background timer refreshes the token ``refresh_lead`` seconds before
+    it expires, so searches normally never wait on the token endpoint.
+    """
+
+    def __init__(self, key, secret, expiry_margin=60, refresh_lead=120, url=None):
+        self.url = url or getty_auth_url
+        self.key = key
+        self.secret = secret
+        self.expiry_margin = expiry_margin
+        self.refresh_lead = refresh_lead
+        self.last_error = None
+        self.refresh_count = 0
+        self._token = None
+        self._expiry = 0.0
+        self._lock = threading.Lock()
+        self._timer = None
+
+    def get_token(self):
+        token, expiry = self._token, self._expiry
+        if token and time.time() < expiry:
+            return token
+        return self.refresh(stale_token=token)
+
+    def refresh(self, stale_token=None):
+        """Fetch a new token unless another caller already replaced ``stale_token``."""
+        with self._lock:
+            if self._token and self._token != stale_token and time.time() < self._expiry:
+                return self._token
+            return self._fetch_token()
+
+    @timed("getty_token_refresh")
+    def _fetch_token(self):
+        # Prepare credentials for basic auth
+        credentials = f"{self.key}:{self.secret}"
+        encoded_credentials = base64.b64encode(credentials.encode()).decode()
+
+        headers = {
+            "Authorization": f"Basic {encoded_credentials}",
+            "Content-Type": "application/x-www-form-urlencoded"
+        }
+
+        data = {
+            "grant_type": "client_credentials"
+        }
+
+        try:
+            response = get_provider_client("getty").post(self.url, headers=headers, data=data)
+        except Exception as e:
+            self.last_error = f"Error getting access token: {str(e)}"
+            return None
+        if response.status_code != 200:
+            self.last_error = f"Failed to get access token: {response.status_code} - {response.text}"
+            return None
+
+        token_data = response.json()
+        expires_in = token_data.get("expires_in", 1800)
+        self._token = token_data.get("access_token")
+        self._expiry = time.time() + expires_in - self.expiry_margin
+        self.last_error = None
+        self.refresh_count += 1
+        self._schedule_refresh(expires_in - self.expiry_margin - self.refresh_lead)
+        return self._token
+
+    def _schedule_refresh(self, delay):
+        if self._timer is not None:
+            self._timer.cancel()
+        # Weakly referenced, so a manager dropped from the resource cache stops refreshing
+        self._timer = threading.Timer(max(delay, 1.0), GettyTokenManager._background_refresh, args=(weakref.ref(self),))
+        self._timer.daemon = True
+        self._timer.start()
+
+    @staticmethod
+    def _background_refresh(ref):
+        manager = ref()
+        if manager is None:
+            return
+        # Keeps serving the current token until the new one is in place
+        with manager._lock:
+            manager._fetch_token()
+
+
+# Shared by every session of this Streamlit process
+@st.cache_resource(show_spinner=False)
+def get_token_manager():
+    return GettyTokenManager(api_key, client_secret, expiry_margin=token_expiry_margin, refresh_lead=token_refresh_lead)
+
+# Messages from searches running off the script thread are collected here (see SearchJob)
+_notices = threading.local()
+
+def report(level, message):
+    """Show ``message`` with st.error / st.warning, or collect it for the panel of a background search.
+
+    st.* calls only reach the page from the script thread; on other threads
+    without a collecting SearchJob the message is dropped.
+    """
+    sink = getattr(_notices, "sink", None)
+    if sink is not None:
+        sink.append((level, message))
+    elif get_script_run_ctx(suppress_warning=True) is not None:
+        getattr(st, level)(message)
+
+@timed("get_access_token")
 def get_access_token():
     """Get OAuth2 access token for Getty Images API"""
-    global access_token, token_expiry
-    
-    # Check if we have a valid token
-    if access_token and token_expiry:
-        import time
-        if time.time() < token_expiry:
-            return access_token
-    
-    url = "https://authentication.gettyimages.com/oauth2/token"
-    
-    # Prepare credentials for basic auth
-    credentials = f"{api_key}:{client_secret}"
-    encoded_credentials = base64.b64encode(credentials.encode()).decode()
-    
-    headers = {
-        "Authorization": f"Basic {encoded_credentials}",
-        "Content-Type": "application/x-www-form-urlencoded"
-    }
-    
-    data = {
-        "grant_type": "client_credentials"
-    }
-    
-    try:
-        response = requests.post(url, headers=headers, data=data)
-        if response.status_code == 200:
-            token_data = response.json()
-            access_token = token_data.get("access_token")
-            expires_in = token_data.get("expires_in", 1800)
-            
-            import time
-            token_expiry = time.time() + expires_in - 60  # Refresh 1 minute before expiry
-            
-            return access_token
-        else:
-            st.error(f"Failed to get access token: {response.status_code} - {response.text}")
+    manager = get_token_manager()
+    token = manager.get_token()
+    if not token and manager.last_error:
+        report("error", manager.last_error)
+    return token
+
+def search_cache_key(provider, query, page, per_page, orientation, pushdown=""):
+    """Normalized cache key for one page of search results.
+
+    ``pushdown`` identifies the server-side filters sent with the request
+    (see ``ProviderAdapter.cache_tag``), so differently filtered pages don't mix.
+    """
+    query = " ".join(urllib.parse.unquote_plus(query).lower().split())
+    return (provider, query, int(page), int(per_page), orientation or "", pushdown)
+
+
+class SearchCache:
+    """Two-level cache for provider search pages.
+
+    Level 1 is an in-process LRU with a TTL, level 2 a SQLite file that
+    survives restarts and is trimmed to ``max_bytes`` by evicting the least
+    recently used pages. Values are ``(images, total)`` tuples as returned by
+    ``fetch_images_page``.
+    """
+
+    def __init__(self, path, maxsize=512, ttl=3600, disk_ttl=7 * 24 * 3600, max_bytes=512 * 1024 * 1024):
+        self.path = path
+        self.disk_ttl = disk_ttl
+        self.max_bytes = max_bytes
+        self.memory = TTLCache(maxsize=maxsize, ttl=ttl)
+        self.counters = {"memory_hits": 0, "disk_hits": 0, "misses": 0, "writes": 0, "evictions": 0}
+        self._lock = threading.Lock()
+        self._db = None
+        if path:
+            if os.path.dirname(path):
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+            self._db = sqlite3.connect(path, check_same_thread=False)
+            self._db.execute(
+                """CREATE TABLE IF NOT EXISTS search_cache (
+                    key TEXT PRIMARY KEY,
+                    provider TEXT,
+                    query TEXT,
+                    payload TEXT,
+                    created REAL,
+                    accessed REAL,
+                    size INTEGER
+                )"""
+            )
+            self._db.execute("CREATE INDEX IF NOT EXISTS search_cache_accessed ON search_cache (accessed)")
+            self._db.commit()
+
+    def get(self, key, count=True):
+        """Cached ``(images, total)`` or None; ``count=False`` leaves the hit/miss counters alone."""
+        now = time.time()
+        with self._lock:
+            value = self.memory.get(key)
+            if value is not None:
+                self.counters["memory_hits"] += count
+                return value
+            if self._db is not None:
+                row = self._db.execute(
+                    "SELECT payload, created FROM search_cache WHERE key = ?", (json.dumps(key),)
+                ).fetchone()
+                if row and now - row[1] < self.disk_ttl:
+                    self._db.execute("UPDATE search_cache SET accessed = ? WHERE key = ?", (now, json.dumps(key)))
+                    self._db.commit()
+                    images, total = json.loads(row[0])
+                    value = (images, total)
+                    self.memory[key] = value
+                    self.counters["disk_hits"] += count
+                    return value
+            self.counters["misses"] += count
             return None
-    except Exception as e:
-        st.error(f"Error getting access token: {str(e)}")
-        return None
+
+    def set(self, key, images, total):
+        value = (images, total)
+        now = time.time()
+        with self._lock:
+            self.memory[key] = value
+            self.counters["writes"] += 1
+            if self._db is None:
+                return
+            payload = json.dumps([images, total])
+            self._db.execute(
+                "INSERT OR REPLACE INTO search_cache VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (json.dumps(key), key[0], key[1], payload, now, now, len(payload)),
+            )
+            self._evict()
+            self._db.commit()
+
+    def _evict(self):
+        """Drop expired pages, then least recently used pages until under max_bytes."""
+        cur = self._db.execute("DELETE FROM search_cache WHERE created < ?", (time.time() - self.disk_ttl,))
+        self.counters["evictions"] += cur.rowcount
+        used = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM search_cache").fetchone()[0]
+        if used <= self.max_bytes:
+            return
+        for key, size in self._db.execute("SELECT key, size FROM search_cache ORDER BY accessed").fetchall():
+            if used <= self.max_bytes:
+                break
+            self._db.execute("DELETE FROM search_cache WHERE key = ?", (key,))
+            used -= size
+            self.counters["evictions"] += 1
+
+    def get_stale(self, key):
+        """A cached page however old it is, for when upstream cannot be asked; None if never cached."""
+        with self._lock:
+            value = self.memory.get(key)
+            if value is not None or self._db is None:
+                return value
+            row = self._db.execute("SELECT payload FROM search_cache WHERE key = ?", (json.dumps(key),)).fetchone()
+            if row is None:
+                return None
+            images, total = json.loads(row[0])
+            return images, total
+
+    def contains(self, key):
+        """Whether a fresh page is cached, without touching hit statistics or recency."""
+        with self._lock:
+            if key in self.memory:
+                return True
+            if self._db is None:
+                return False
+            row = self._db.execute("SELECT created FROM search_cache WHERE key = ?", (json.dumps(key),)).fetchone()
+            return bool(row) and time.time() - row[0] < self.disk_ttl
+
+    def invalidate(self, provider=None, query=None):
+        """Remove cached pages for a provider and/or query (everything when both are None)."""
+        if query is not None:
+            query = search_cache_key(provider, query, 0, 0, "")[1]
+        with self._lock:
+            removed = 0
+            for key in list(self.memory.keys()):
+                if (provider is None or key[0] == provider) and (query is None or key[1] == query):
+                    self.memory.pop(key, None)
+                    removed += 1
+            if self._db is not None:
+                clauses, args = [], []
+                if provider is not None:
+                    clauses.append("provider = ?")
+                    args.append(provider)
+                if query is not None:
+                    clauses.append("query = ?")
+                    args.append(query)
+                where = f" WHERE {' AND '.join(clauses)}" if clauses else ""
+                cur = self._db.execute(f"DELETE FROM search_cache{where}", args)
+                self._db.commit()
+                removed = max(removed, cur.rowcount)
+            return removed
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self.counters)
+            stats["memory_entries"] = len(self.memory)
+            stats["disk_entries"], stats["disk_bytes"] = (0, 0)
+            if self._db is not None:
+                stats["disk_entries"], stats["disk_bytes"] = self._db.execute(
+                    "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM search_cache"
+                ).fetchone()
+        lookups = stats["memory_hits"] + stats["disk_hits"] + stats["misses"]
+        stats["hit_rate"] = (stats["memory_hits"] + stats["disk_hits"]) / lookups if lookups else 0.0
+        return stats
+
+
+# Shared by every session of this Streamlit process
+@st.cache_resource(show_spinner=False)
+def get_search_cache():
+    return SearchCache(
+        search_cache_path,
+        maxsize=search_cache_size,
+        ttl=search_cache_ttl,
+        disk_ttl=search_cache_disk_ttl,
+        max_bytes=search_cache_max_bytes,
+    )
+
+class SingleFlight:
+    """Process-wide de-duplication of identical in-flight calls.
+
+    The first caller for a key runs the function; callers that arrive while
+    it is running wait for it and share its result (or exception) instead of
+    starting their own upstream request.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+        self.leaders = 0
+        self.coalesced = 0
+
+    def do(self, key, fn):
+        """Return (result, shared); shared is True when another caller's run was reused."""
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = {"done": threading.Event(), "result": None, "error": None, "waiters": 0}
+                self.leaders += 1
+            else:
+                call["waiters"] += 1
+                self.coalesced += 1
+        if not leader:
+            call["done"].wait()
+            if call["error"] is not None:
+                raise call["error"]
+            return call["result"], True
+        try:
+            call["result"] = fn()
+        except Exception as e:
+            call["error"] = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call["done"].set()
+        return call["result"], False
+
+    def stats(self):
+        with self._lock:
+            return {"in_flight": len(self._calls), "leaders": self.leaders, "coalesced": self.coalesced}
+
+# Shared by every session of this Streamlit process
+@st.cache_resource(show_spinner=False)
+def get_single_flight():
+    return SingleFlight()
+
+class ImageCache:
+    """Disk cache of downscaled JPEGs for thumbnails and previews.
+
+    Each (url, size) pair is downloaded once, shrunk with Pillow so its
+    longest side is at most ``size`` and stored under ``directory``. Files
+    are evicted least recently used first once ``max_bytes`` is exceeded.
+    ``prefetch`` warms the cache on a background pool; a foreground ``get``
+    for an image that is already being prefetched waits for that download.
+    """
+
+    def __init__(self, directory, max_bytes=1024 * 1024 * 1024, workers=4):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.counters = {"hits": 0, "misses": 0, "prefetched": 0, "errors": 0, "evictions": 0}
+        self._lock = threading.Lock()
+        self._pending = {}
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="image-cache")
+        os.makedirs(directory, exist_ok=True)
+        # path -> size, oldest access first
+        self._index = OrderedDict()
+        self._bytes = 0
+        entries = []
+        for entry in os.scandir(directory):
+            if entry.is_file() and entry.name.endswith(".jpg"):
+                stat = entry.stat()
+                entries.append((stat.st_mtime, entry.path, stat.st_size))
+        for _, path, size in sorted(entries):
+            self._index[path] = size
+            self._bytes += size
+
+    def _path(self, url, size):
+        digest = hashlib.sha1(f"{url}|{size}".encode()).hexdigest()
+        return os.path.join(self.directory, f"{digest}.jpg")
+
+    def get(self, url, size):
+        """Return JPEG bytes for ``url`` downscaled to ``size``, or None if it cannot be fetched."""
+        path = self._path(url, size)
+        with self._lock:
+            pending = self._pending.get(path)
+        if pending is not None:
+            try:
+                pending.result()
+            except Exception:
+                pass  # counted by the prefetch; fall through to a foreground download
+        data = self._read(path)
+        get_metrics().inc("image_cache_lookups", result="miss" if data is None else "hit")
+        if data is not None:
+            with self._lock:
+                self.counters["hits"] += 1
+            return data
+        with self._lock:
+            self.counters["misses"] += 1
+        return self._download(url, size, path)
+
+    def contains(self, url, size):
+        with self._lock:
+            return self._path(url, size) in self._index
+
+    def prefetch(self, urls, size):
+        """Download and downscale ``urls`` in the background."""
+        for url in urls:
+            if not url:
+                continue
+            path = self._path(url, size)
+            with self._lock:
+                if path in self._index or path in self._pending:
+                    continue
+                self._pending[path] = self._pool.submit(self._prefetch_one, url, size, path)
+
+    def _prefetch_one(self, url, size, path):
+        try:
+            if self._download(url, size, path) is not None:
+                with self._lock:
+                    self.counters["prefetched"] += 1
+        finally:
+            with self._lock:
+                self._pending.pop(path, None)
+
+    def _read(self, path):
+        with self._lock:
+            if path not in self._index:
+                return None
+            self._index.move_to_end(path)
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+            os.utime(path)
+            return data
+        except OSError:
+            with self._lock:
+                self._bytes -= self._index.pop(path, 0)
+            return None
+
+    def _download(self, url, size, path):
+        try:
+            response = get_provider_client("images").get(url)
+            if response.status_code != 200:
+                raise ValueError(f"HTTP {response.status_code}")
+            image = Image.open(io.BytesIO(response.content))
+            image.thumbnail((size, size))
+            buffer = io.BytesIO()
+            image.convert("RGB").save(buffer, format="JPEG", quality=85, optimize=True)
+        except Exception:
+            with self._lock:
+                self.counters["errors"] += 1
+            return None
+        data = buffer.getvalue()
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        try:
+            with open(tmp_path, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except OSError:
+            # e.g. disk full: report the image as unavailable rather than failing the render
+            with self._lock:
+                self.counters["errors"] += 1
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+            return None
+        with self._lock:
+            self._bytes += len(data) - self._index.pop(path, 0)
+            self._index[path] = len(data)
+            self._evict()
+        return data
+
+    def _evict(self):
+        while self._bytes > self.max_bytes and len(self._index) > 1:
+            path, size = self._index.popitem(last=False)
+            self._bytes -= size
+            self.counters["evictions"] += 1
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self.counters)
+            stats["entries"] = len(self._index)
+            stats["bytes"] = self._bytes
+        return stats
+
+
+# Shared by every session of this Streamlit process
+@st.cache_resource(show_spinner=False)
+def get_image_cache():
+    return ImageCache(image_cache_dir, max_bytes=image_cache_max_bytes, workers=image_prefetch_workers)
+
+def cached_image(url, size):
+    """Image bytes from the local cache for st.image, falling back to the remote URL."""
+    if not url:
+        return url
+    return get_image_cache().get(url, size) or url
+
+def prefetch_thumbnails(images):
+    """Warm the image cache with the thumbnails of the given images."""
+    get_image_cache().prefetch([get_thumbnail_url(img) for img in images], thumb_display_size)
 
 # Fetch images from Getty and Unsplash together
-def fetch_images(query, page=1, per_page=100, orientation='landscape', use_unsplash=True):
+class ProviderAdapter:
+    """Search request parameters for one provider, with server-side filter pushdown.
+
+    Filter steps describe what they filter as pushdown hints (see
+    ``FilterPipeline.hints``). ``supports`` lists the hints the provider
+    applies completely on its side; the matching steps are dropped from the
+    local filter for that provider's results (``apply_filters``), the
+    others still run locally.
+    """
+
+    name = None
+    supports = frozenset()
+    query_params = ()
+
+    def search_params(self, query, page, per_page, orientation, hints):
+        raise NotImplementedError
+
+    def cache_tag(self, orientation, hints):
+        """The pushed-down part of the request, for the search cache key."""
+        params = self.search_params("", 1, 1, orientation, hints)
+        return ",".join(f"{k}={v}" for k, v in sorted(params.items()) if k not in self.query_params)
+
+class GettyAdapter(ProviderAdapter):
+    """Getty creative search.
+
+    Orientation and editorial-use-only images are filtered by Getty; the
+    creative endpoint never returns publicity images. Excluded keywords that
+    name people become ``number_of_people=none``, and caption/keyword fields
+    are only requested when keywords still have to be matched locally.
+    """
+
+    name = "getty"
+    supports = frozenset({"orientation", "exclude_editorial", "exclude_publicity"})
+    query_params = ("phrase", "page", "page_size")
+    orientations = {"portrait": "Vertical,PanoramicVertical", "landscape": "Horizontal,PanoramicHorizontal"}
+    fields = ("id", "title", "thumb", "preview", "comp", "display_sizes", "max_dimensions")
+    people_keywords = frozenset({"person", "people", "man", "men", "woman", "women", "boy", "girl", "face", "group"})
+
+    def search_params(self, query, page, per_page, orientation, hints):
+        params = {"phrase": query, "page": page, "page_size": per_page}
+        fields = list(self.fields)
+        if orientation in self.orientations:
+            params["orientations"] = self.orientations[orientation]
+        if hints.get("exclude_editorial"):
+            params["exclude_editorial_use_only"] = "true"
+        keywords = hints.get("exclude_keywords")
+        if keywords:
+            if self.people_keywords.intersection(keywords):
+                params["number_of_people"] = "none"
+            fields += ["caption", "keywords"]
+        params["fields"] = ",".join(fields)
+        return params
+
+class UnsplashAdapter(ProviderAdapter):
+    """Unsplash photo search.
+
+    Orientation is filtered by Unsplash. Unsplash has no editorial-only or
+    publicity images, so those filters have nothing to drop locally.
+    """
+
+    name = "unsplash"
+    supports = frozenset({"orientation", "exclude_editorial", "exclude_publicity"})
+    query_params = ("query", "page", "per_page")
+
+    def search_params(self, query, page, per_page, orientation, hints):
+        params = {
+            "query": query,  # requests encodes it
+            "page": page,  # Include page number for pagination
+            "per_page": per_page,  # Number of images per page
+        }
+        if orientation in ("portrait", "landscape"):
+            params["orientation"] = orientation
+        return params
+
+provider_adapters = {"getty": GettyAdapter(), "unsplash": UnsplashAdapter()}
+
+def fetch_images(query, page=1, per_page=100, orientation='landscape', use_unsplash=True, providers=None, filters=None, priority="interactive"):
+    images, _ = fetch_images_page(query, page=page, per_page=per_page, orientation=orientation, use_unsplash=use_unsplash, providers=providers, filters=filters, priority=priority)
+    return images
+
+# Fetch a single page of images together with the provider's total result count
+def fetch_images_page(query, page=1, per_page=100, orientation='landscape', use_unsplash=True, use_cache=True, providers=None, filters=None, priority="interactive"):
+    """Return (images, total) for one page; total is None when the request failed.
+
+    ``providers`` (e.g. ("getty", "unsplash")) overrides ``use_unsplash``;
+    with more than one provider the page is fetched from all of them at once.
+    ``filters`` (a FilterPipeline) is pushed into the request as far as the
+    provider supports it; apply it with ``apply_filters`` afterwards.
+    ``priority`` ("interactive", "read_ahead" or "background") orders the
+    request in the upstream scheduler. When the scheduler defers it, an
+    expired cached copy is served if there is one, else UpstreamDeferred is
+    raised.
+    """
+    if providers:
+        if len(providers) > 1:
+            return fetch_images_fanout(query, page=page, per_page=per_page, orientation=orientation, providers=providers, use_cache=use_cache, filters=filters, priority=priority)
+        use_unsplash = providers[0] == "unsplash"
+    hints = filters.hints() if filters else {}
+    if not use_cache:
+        return _fetch_images_page_upstream(query, page, per_page, orientation, use_unsplash, hints, priority)
+
+    provider = "unsplash" if use_unsplash else "getty"
+    cache = get_search_cache()
+    key = search_cache_key(provider, query, page, per_page, orientation, provider_adapters[provider].cache_tag(orientation, hints))
+    cached = cache.get(key)
+    get_metrics().inc("search_cache_lookups", provider=provider, result="miss" if cached is None else "hit")
+    if cached is not None:
+        return cached
+
+    def fetch():
+        # A flight that finished just before this one started has already filled the cache
+        # (not counted: this lookup already counted as a miss above)
+        cached = cache.get(key, count=False)
+        if cached is not None:
+            return cached
+        images, total = _fetch_images_page_upstream(query, page, per_page, orientation, use_unsplash, hints, priority)
+        if total is not None:
+            cache.set(key, images, total)
+        return images, total
+
+    # Identical searches from other sessions that are already in flight are joined, not repeated
+    rank = UpstreamScheduler.priorities.index(priority)
+    while True:
+        try:
+            (images, total), shared = get_single_flight().do(key, fetch)
+            break
+        except UpstreamDeferred as e:
+            if UpstreamScheduler.priorities.index(e.priority) > rank:
+                continue  # joined a less urgent flight that was turned away, ask again at our priority
+            stale = cache.get_stale(key)
+            if stale is None:
+                raise
+            get_metrics().inc("search_degraded", provider=provider, result="stale")
+            return stale
+    get_metrics().inc("search_flights", provider=provider, result="coalesced" if shared else "leader")
+    return images, total
+
+def search_page_cached(query, page, per_page, orientation, providers, filters=None):
+    """True when every provider's copy of this page is already in the search cache."""
+    hints = filters.hints() if filters else {}
+    cache = get_search_cache()
+    return all(
+        cache.contains(search_cache_key(provider, query, page, per_page, orientation, provider_adapters[provider].cache_tag(orientation, hints)))
+        for provider in providers
+    )
 
+# Query several providers at once and interleave whatever arrives before the deadline
+def fetch_images_fanout(query, page=1, per_page=100, orientation='landscape', providers=("getty", "unsplash"), deadline=None, use_cache=True, filters=None, priority="interactive"):
+    """Fetch one page from every provider concurrently under one overall deadline.
+
+    Results are interleaved round-robin by provider rank (first Getty hit,
+    first Unsplash hit, ...) and tagged with a ``provider`` key. Providers
+    that miss the deadline or are deferred are left out of the page (see
+    ``fetch_provider_pages``). Returns (images, total) with total summed over
+    the providers that answered, or None if none did.
+    """
+    results, _ = fetch_provider_pages(
+        query, dict.fromkeys(providers, page), per_page=per_page, orientation=orientation,
+        deadline=deadline, use_cache=use_cache, filters=filters, priority=priority,
+    )
+    totals = [total for _, total in results.values() if total is not None]
+    merged = interleave_results([results[provider][0] for provider in providers if provider in results])
+    return merged, sum(totals) if totals else None
+
+def fetch_provider_pages(query, pages, per_page=100, orientation='landscape', deadline=None, use_cache=True, filters=None, priority="interactive"):
+    """Fetch page ``pages[provider]`` from each provider concurrently under one overall deadline.
+
+    Returns ({provider: (images, total)}, late). Images are tagged with a
+    ``provider`` key. A provider that misses the deadline is listed in
+    ``late`` instead of holding the others back; its request keeps running
+    and still lands in the search cache. A provider whose request is deferred
+    by the upstream scheduler is left out too, and if no provider answered
+    because of that, UpstreamDeferred is raised.
+    """
+    deadline = fanout_deadline if deadline is None else deadline
+    pool = _worker_pool(len(pages))
+    futures = {
+        pool.submit(
+            fetch_images_page, query, page=page, per_page=per_page, orientation=orientation,
+            use_unsplash=provider == "unsplash", use_cache=use_cache, filters=filters, priority=priority,
+        ): provider
+        for provider, page in pages.items()
+    }
+    done, not_done = wait(futures, timeout=deadline)
+    pool.shutdown(wait=False)
+
+    results = {}
+    deferred = []
+    for future in done:
+        provider = futures[future]
+        try:
+            images, total = future.result()
+        except UpstreamDeferred as e:
+            deferred.append(e)
+            continue
+        results[provider] = ([dict(img, provider=provider) for img in images], total)
+    for future in not_done:
+        report("warning", f"{provider_labels[futures[future]]} did not answer within {deadline:g}s, showing other results")
+    if deferred and not results and not not_done:
+        raise deferred[0]
+    return results, [futures[future] for future in not_done]
+
+def interleave_results(ranked):
+    """Merge per-provider result lists round-robin by rank."""
+    merged = []
+    for rank in range(max((len(images) for images in ranked), default=0)):
+        for images in ranked:
+            if rank < len(images):
+                merged.append(images[rank])
+    return merged
+
+def _fetch_images_page_upstream(query, page, per_page, orientation, use_unsplash, hints=None, priority="interactive"):
+    provider = "unsplash" if use_unsplash else "getty"
+    with get_metrics().span("fetch_images_page", provider=provider):
+        images, total = _fetch_images_page_request(query, page, per_page, orientation, use_unsplash, hints or {}, priority)
+    get_metrics().inc("results_fetched", len(images), provider=provider)
+    return images, total
+
+def _fetch_images_page_request(query, page, per_page, orientation, use_unsplash, hints, priority):
     if use_unsplash == False:
         # Fetch Getty images
         token = get_access_token()
         if not token:
-            return []
+            return [], None
 
         # Getty API request
-        getty_url = "https://api.gettyimages.com/v3/search/images/creative"
+        getty_url = f"{getty_api_url}/search/images/creative"
         headers = {
             "Api-Key": api_key,
             "Authorization": f"Bearer {token}",
             "Accept": "application/json"
         }
-        params = {
-            "phrase": query,
-            "page": page,
-            "page_size": per_page,
-            "fields": "id,title,thumb,preview,comp,display_sizes,max_dimensions"
-        }
-
-        getty_response = requests.get(getty_url, headers=headers, params=params)
+        params = provider_adapters["getty"].search_params(query, page, per_page, orientation, hints)
+
+        try:
+            getty_response = get_provider_client("getty").get(getty_url, headers=headers, params=params, priority=priority)
+            if getty_response.status_code == 401:
+                # Token was revoked or expired early: refresh once (single-flight) and retry
+                token = get_token_manager().refresh(stale_token=token)
+                if token:
+                    headers["Authorization"] = f"Bearer {token}"
+                    getty_response = get_provider_client("getty").get(getty_url, headers=headers, params=params, priority=priority)
+        except requests.RequestException as e:
+            report("error", f"Error calling Getty Images API: {str(e)}")
+            return [], None
         getty_images = []
+        getty_total = None
         if getty_response.status_code == 200:
-            getty_images = getty_response.json().get("images", [])
+            getty_data = getty_response.json()
+            getty_images = getty_data.get("images", [])
+            getty_total = getty_data.get("result_count")
         else:
-            st.error(f"Getty Images API error {getty_response.status_code}: {getty_response.text}")
+            report("error", f"Getty Images API error {getty_response.status_code}: {getty_response.text}")
 
-        return getty_images
+        return getty_images, getty_total
 
     else:
         # Fetch Unsplash images
-        unsplash_url = "https://api.unsplash.com/search/photos"
+        unsplash_url = f"{unsplash_api_url}/search/photos"
         unsplash_headers = {
             "Authorization": f"Client-ID {unsplash_access_key}"
         }
 
-        encoded_query = urllib.parse.quote_plus(query)
+        unsplash_params = provider_adapters["unsplash"].search_params(query, page, per_page, orientation, hints)
 
-        if orientation == 'portrait':
-            unsplash_params = {
-                "query": f"{encoded_query} ",
-                "page": page,  # Include page number for pagination
-                "per_page": per_page,  # Number of images per page
-                # Do not pass 'orientation' to Unsplash for city search, we'll filter later
-            }
-        else:
-            # For the attraction section, only fetch landscape
-            unsplash_params = {
-                "query": f"{encoded_query} ",
-                "page": page,
-                "per_page": 100,
-                "orientation": orientation  # Apply landscape filter for attractions
-            }
-
-        unsplash_response = requests.get(unsplash_url, headers=unsplash_headers, params=unsplash_params)
+        try:
+            unsplash_response = get_provider_client("unsplash").get(unsplash_url, headers=unsplash_headers, params=unsplash_params, priority=priority)
+        except requests.RequestException as e:
+            report("error", f"Error calling Unsplash API: {str(e)}")
+            return [], None
         unsplash_images = []
+        unsplash_total = None
         if unsplash_response.status_code == 200:
-            unsplash_images = unsplash_response.json().get("results", [])
+            unsplash_data = unsplash_response.json()
+            unsplash_images = unsplash_data.get("results", [])
+            unsplash_total = unsplash_data.get("total")
         else:
-            st.error(f"Unsplash API error {unsplash_response.status_code}: {unsplash_response.text}")
+            report("error", f"Unsplash API error {unsplash_response.status_code}: {unsplash_response.text}")
 
         # Combine Getty and Unsplash images
-        return unsplash_images
+        return unsplash_images, unsplash_total
+
+class ImageBatch:
+    """Columnar view of a list of images (raw dicts or ImageRecords) for filtering.
+
+    Columns are extracted on first use, so a pipeline only pays for the
+    fields its steps read; text and tags are read per row for the rows a
+    keyword step still has to scan.
+    """
+
+    def __init__(self, images):
+        self.images = images
+        self._dimensions = None
+        self._flags = None
+
+    def __len__(self):
+        return len(self.images)
+
+    @property
+    def width(self):
+        if self._dimensions is None:
+            self._dimensions = self._columns(('width', 'height'), _image_dimensions, np.int64)
+        return self._dimensions[0]
+
+    @property
+    def height(self):
+        if self._dimensions is None:
+            self._dimensions = self._columns(('width', 'height'), _image_dimensions, np.int64)
+        return self._dimensions[1]
+
+    @property
+    def editorial_only(self):
+        if self._flags is None:
+            self._flags = self._columns(('editorial_only', 'publicity'), _image_flags, bool)
+        return self._flags[0]
+
+    @property
+    def publicity(self):
+        if self._flags is None:
+            self._flags = self._columns(('editorial_only', 'publicity'), _image_flags, bool)
+        return self._flags[1]
+
+    def _columns(self, fields, extract, dtype):
+        """One array per field: attribute reads for ImageRecords, ``extract`` for raw dicts."""
+        n = len(self.images)
+        try:
+            return [np.fromiter(map(attrgetter(field), self.images), dtype=dtype, count=n) for field in fields]
+        except AttributeError:  # raw provider dicts (or a mix)
+            flat = np.fromiter(chain.from_iterable(map(extract, self.images)), dtype=dtype, count=len(fields) * n)
+            return list(flat.reshape(-1, len(fields)).T)
+
+    def text(self, i):
+        img = self.images[i]
+        if not isinstance(img, dict):  # ImageRecord
+            return img.caption
+        return " ".join(filter(None, [img.get('alt_description'), img.get('caption')]))
+
+    def tags(self, i):
+        img = self.images[i]
+        if not isinstance(img, dict):  # ImageRecord
+            return img.tags
+        return tuple(tag['title'].lower() for tag in img.get('tags', []) if tag.get('title'))
+
+
+def _image_dimensions(img):
+    if not isinstance(img, dict):  # ImageRecord
+        return img.width or 0, img.height or 0
+    if 'max_dimensions' in img:  # Getty Images
+        dimensions = img['max_dimensions']
+    else:  # Unsplash Images
+        dimensions = img
+    return dimensions.get('width') or 0, dimensions.get('height') or 0
+
+def _image_flags(img):
+    """(editorial_only, publicity) for one image."""
+    if not isinstance(img, dict):  # ImageRecord
+        return img.editorial_only, img.publicity
+    return (
+        bool((img.get('allowed_use') or {}).get('editorial_use_only', False)),
+        'publicity' in (img.get('editorial_segments') or []),
+    )
 
-def filter_images(images):
-    filtered_images = []
-    # Add keywords and their plural forms or related terms
-    exclude_keywords = [
-        'person', 'people', 'man', 'woman', 'boy', 'girl', 'logo', 'brand',
-        'advertisement', 'company', 'corporate', 'sign', 'trademark', 'product',
-        'face', 'group'
-    ]
-
-    for image in images:
-        # Check Unsplash-style fields
-        description = image.get('alt_description', '').lower()
-        tags = [tag['title'].lower() for tag in image.get('tags', [])]
-        if any(keyword in description for keyword in exclude_keywords):
-            continue
-        if any(keyword in tags for keyword in exclude_keywords):
-            continue
 
-        # Check Getty-style fields
-        caption = image.get('caption', '').lower()
-        if any(keyword in caption for keyword in exclude_keywords):
-            continue
+# Filter steps take an ImageBatch and the rows still kept, and return a boolean keep mask
+def orientation_filter(orientation):
+    """Keep portrait (height > width) or landscape (width > height) images."""
+    def step(batch, keep):
+        if orientation == 'portrait':
+            return batch.height > batch.width
+        return batch.width > batch.height
+    step.pushdown = {"orientation": orientation}
+    return step
+
+def flag_filter(exclude_publicity=True, exclude_editorial=True):
+    """Drop Getty publicity and editorial-use-only images."""
+    def step(batch, keep):
+        mask = np.ones(len(batch), dtype=bool)
+        if exclude_publicity:
+            mask &= ~batch.publicity
+        if exclude_editorial:
+            mask &= ~batch.editorial_only
+        return mask
+    step.pushdown = {"exclude_publicity": exclude_publicity, "exclude_editorial": exclude_editorial}
+    return step
+
+def keyword_filter(keywords):
+    """Drop images whose description/caption or tags mention an excluded keyword.
+
+    Keywords match as whole words (plus plural "s"/"es"), so "man" excludes
+    "a man walking" but not "Romanesque church"; a tag is excluded when the
+    whole tag is such a match ("Signs", but not "signpost").
+    """
+    pattern = re.compile(
+        r"\b(?:" + "|".join(re.escape(k) for k in sorted(keywords, key=len, reverse=True)) + r")(?:s|es)?\b",
+        re.IGNORECASE,
+    )
+    keyword_set = frozenset(keywords)
+
+    def step(batch, keep):
+        mask = keep.copy()
+        # Only rows that survived cheaper steps need a text scan
+        for i in np.flatnonzero(keep):
+            if any(pattern.fullmatch(tag) for tag in batch.tags(i)) or pattern.search(batch.text(i)):
+                mask[i] = False
+        return mask
+    step.pushdown = {"exclude_keywords": keyword_set}
+    return step
+
+
+class FilterPipeline:
+    """Single-pass filter built from composable steps.
+
+    Steps run in order over one ImageBatch and are AND-ed into a keep mask;
+    ``then`` returns a new pipeline with extra steps appended. Calling the
+    pipeline returns the kept images in their original order and type.
+    """
+
+    def __init__(self, *steps):
+        self.steps = steps
+
+    def then(self, *steps):
+        extra = []
+        for step in steps:
+            extra.extend(step.steps if isinstance(step, FilterPipeline) else [step])
+        return FilterPipeline(*self.steps, *extra)
+
+    def hints(self):
+        """Pushdown hints of all steps, for ProviderAdapter.search_params."""
+        hints = {}
+        for step in self.steps:
+            hints.update(getattr(step, "pushdown", {}))
+        return hints
+
+    def residual(self, supports):
+        """The steps a provider supporting ``supports`` hints does not apply itself."""
+        return FilterPipeline(*[
+            step for step in self.steps
+            if not getattr(step, "pushdown", None) or not supports.issuperset(step.pushdown)
+        ])
+
+    def mask(self, images):
+        batch = images if isinstance(images, ImageBatch) else ImageBatch(images)
+        keep = np.ones(len(batch), dtype=bool)
+        for step in self.steps:
+            if not keep.any():
+                break
+            keep &= step(batch, keep)
+        return keep
 
-        editorial_segments = image.get('editorial_segments', [])
-        if 'publicity' in editorial_segments:
-            continue
+    def __call__(self, images):
+        if not images:
+            return []
+        keep = self.mask(images)
+        return list(compress(images, keep.tolist()))
 
-        allowed_use = image.get('allowed_use', {})
-        if allowed_use.get('editorial_use_only', False):
-            continue
 
-        filtered_images.append(image)
+content_filter = FilterPipeline(flag_filter(), keyword_filter(exclude_keywords))
+portrait_filter = FilterPipeline(orientation_filter('portrait'))
+landscape_filter = FilterPipeline(orientation_filter('landscape'))
+
+@timed("filter_images")
+def filter_images(images):
+    """Drop people/brand images and Getty publicity or editorial-only images."""
+    return content_filter(images)
+
+def apply_filters(pipeline, records):
+    """Filter ImageRecords fetched with ``filters=pipeline``, skipping steps each provider already applied."""
+    residuals = {provider: pipeline.residual(provider_adapters[provider].supports) for provider in {r.provider for r in records}}
+    if len(residuals) <= 1:
+        return next(iter(residuals.values()))(records) if residuals else []
+    keep = np.zeros(len(records), dtype=bool)
+    for provider, residual in residuals.items():
+        rows = [i for i, record in enumerate(records) if record.provider == provider]
+        keep[rows] = residual.mask([records[i] for i in rows])
+    return list(compress(records, keep.tolist()))
 
-    return filtered_images
 
+# Thread pool whose workers can still report errors to the current Streamlit page (or SearchJob)
+def _worker_pool(max_workers):
+    ctx = get_script_run_ctx(suppress_warning=True)
+    sink = getattr(_notices, "sink", None)
+
+    def attach_ctx():
+        if ctx is not None:
+            add_script_run_ctx(ctx=ctx)
+        _notices.sink = sink
+
+    return ThreadPoolExecutor(max_workers=max_workers, initializer=attach_ctx)
 
 # Fetch multiple pages of images (adjusted)
-def fetch_many_images(query, max_pages=15, per_page=100, orientation='landscape', use_unsplash=True):
-    """Fetch multiple pages of results from Getty and Unsplash for a query."""
-    all_images = []
-    for page in range(1, max_pages + 1):
-        images = fetch_images(query, page=page, per_page=per_page, orientation=orientation, use_unsplash=use_unsplash)
-        if not images:
-            break
-        all_images.extend(images)
-        if len(images) < per_page:
-            break  # No more pages
+@timed("fetch_many_images")
+def fetch_many_images(query, max_pages=15, per_page=100, orientation='landscape', use_unsplash=True, parallel=True, providers=None, filters=None, priority="interactive", strict=False):
+    """Fetch multiple pages of results from Getty and Unsplash for a query.
+
+    Page 1 is fetched first to read the provider's total result count; the
+    remaining pages are then requested concurrently on a bounded worker pool.
+    Pages are stitched back in page order and stop at the first empty or short
+    page, exactly like the sequential loop. Page 1 is scheduled at
+    ``priority`` and the rest as read-ahead (or at ``priority`` if that is
+    lower); if the scheduler defers a later page, the pages before it are
+    returned. A failed page ends the results too, unless ``strict`` is set:
+    then it raises SearchFailed, so callers can tell it from the last page.
+    """
+    def fetch_page(page, priority):
+        images, total = fetch_images_page(query, page=page, per_page=per_page, orientation=orientation, use_unsplash=use_unsplash, providers=providers, filters=filters, priority=priority)
+        if strict and total is None and not images:
+            raise SearchFailed(f"page {page} of {query!r} failed")
+        return images, total
+
+    first_images, total = fetch_page(1, priority)
+    all_images = list(first_images)
+    if not first_images or len(first_images) < per_page:
+        return all_images
+
+    more_priority = "read_ahead" if priority == "interactive" else priority
+    if not parallel or total is None:
+        for page in range(2, max_pages + 1):
+            try:
+                images, _ = fetch_page(page, more_priority)
+            except UpstreamDeferred:
+                get_metrics().inc("search_degraded", result="partial")
+                break
+            if not images:
+                break
+            all_images.extend(images)
+            if len(images) < per_page:
+                break  # No more pages
+        return all_images
+
+    last_page = min(max_pages, math.ceil(total / per_page))
+    if last_page < 2:
+        return all_images
+
+    pages = range(2, last_page + 1)
+    with _worker_pool(min(max_fetch_workers, len(pages))) as pool:
+        results = pool.map(lambda page: fetch_page(page, more_priority), pages)
+        try:
+            for images, _ in results:
+                if not images:
+                    break
+                all_images.extend(images)
+                if len(images) < per_page:
+                    break  # No more pages
+        except UpstreamDeferred:
+            get_metrics().inc("search_degraded", result="partial")
     return all_images
 
+class ImageRecord(NamedTuple):
+    """The fields the app uses from one Getty or Unsplash result."""
+    id: str
+    provider: str
+    thumb_url: str
+    preview_url: str
+    full_url: str
+    width: int
+    height: int
+    description: str
+    attribution: str
+    caption: str = ""
+    tags: tuple = ()
+    editorial_only: bool = False
+    publicity: bool = False
+
+
+def normalize_image(img):
+    """Build an ImageRecord from a raw Getty or Unsplash result dict."""
+    if img.get('provider') == 'getty' or 'display_sizes' in img or 'max_dimensions' in img:  # Getty Images
+        sizes = {size.get("name"): size.get("uri") for size in img.get("display_sizes", [])}
+        dimensions = img.get('max_dimensions') or {}
+        return ImageRecord(
+            id=str(img.get('id', '')),
+            provider="getty",
+            thumb_url=get_thumbnail_url(img),
+            preview_url=sizes.get("preview") or sizes.get("comp") or get_thumbnail_url(img),
+            full_url=get_largest_image_url(img),
+            width=dimensions.get('width') or 0,
+            height=dimensions.get('height') or 0,
+            description=img.get('title') or 'No description available',
+            attribution="Getty Images",
+            caption=img.get('caption') or '',
+            tags=tuple(
+                (tag if isinstance(tag, str) else tag.get('text') or '').lower()
+                for tag in img.get('keywords', []) if isinstance(tag, str) or tag.get('text')
+            ),
+            editorial_only=bool((img.get('allowed_use') or {}).get('editorial_use_only', False)),
+            publicity='publicity' in (img.get('editorial_segments') or []),
+        )
+    # Unsplash Images
+    urls = img.get('urls') or {}
+    user = img.get('user') or {}
+    description = img.get('alt_description') or 'No description available'
+    attribution = ""
+    if user:
+        attribution = f"Photo by [@{user.get('name', '')}]({(user.get('links') or {}).get('html', '')}) on Unsplash"
+    return ImageRecord(
+        id=str(img.get('id', '')),
+        provider="unsplash",
+        thumb_url=urls.get("thumb"),
+        preview_url=urls.get("regular") or urls.get("full"),
+        full_url=urls.get("full"),
+        width=img.get('width') or 0,
+        height=img.get('height') or 0,
+        description=description,
+        attribution=attribution,
+        caption=img.get('alt_description') or '',
+        tags=tuple(tag['title'].lower() for tag in img.get('tags', []) if tag.get('title')),
+    )
+
+
+def normalize_images(images):
+    return [normalize_image(img) for img in images]
+
+
+def difference_hash(data, size=8):
+    """64-bit difference hash of an image: is each pixel brighter than its right neighbour.
+
+    Computed on a (size + 1) x size grayscale downscale, so it survives
+    resizing, recompression and small colour or crop changes.
+    """
+    with Image.open(io.BytesIO(data)) as image:
+        image.draft("L", (size * 4, size * 4))  # let the JPEG decoder skip most of the pixels
+        pixels = np.asarray(image.convert("L").resize((size + 1, size), Image.LANCZOS), dtype=np.int16)
+    bits = (pixels[:, 1:] > pixels[:, :-1]).ravel()
+    return int.from_bytes(np.packbits(bits).tobytes(), "big")
+
+
+class PerceptualHashCache:
+    """Difference hashes of result thumbnails, kept per (provider, image id).
+
+    Thumbnails are read through the ImageCache, which the results grid uses
+    too, so hashing an image costs at most the thumbnail download the grid
+    would make when paging to it. Missing hashes are computed in parallel.
+    """
+
+    def __init__(self, maxsize=50000, workers=8):
+        self.maxsize = maxsize
+        self.workers = workers
+        self.hashes = OrderedDict()
+        self.counters = {"hits": 0, "misses": 0, "errors": 0}
+        self._lock = threading.Lock()
+
+    def get_many(self, records):
+        """Hash for each ImageRecord, None where the thumbnail could not be loaded."""
+        keys = [(record.provider, record.id or record.thumb_url) for record in records]
+        with self._lock:
+            hashes = [self.hashes.get(key) for key in keys]
+            for key, value in zip(keys, hashes):
+                if value is not None:
+                    self.hashes.move_to_end(key)
+            self.counters["hits"] += sum(value is not None for value in hashes)
+        missing = [i for i, value in enumerate(hashes) if value is None and records[i].thumb_url]
+        if missing:
+            with _worker_pool(min(self.workers, len(missing))) as pool:
+                computed = pool.map(lambda i: self._compute(records[i].thumb_url), missing)
+                for i, value in zip(missing, computed):
+                    hashes[i] = value
+            with self._lock:
+                for i in missing:
+                    if hashes[i] is None:
+                        self.counters["errors"] += 1
+                        continue
+                    self.counters["misses"] += 1
+                    self.hashes[keys[i]] = hashes[i]
+                while len(self.hashes) > self.maxsize:
+                    self.hashes.popitem(last=False)
+        return hashes
+
+    @staticmethod
+    def _compute(thumb_url):
+        data = get_image_cache().get(thumb_url, thumb_display_size)
+        if data is None:
+            return None
+        try:
+            return difference_hash(data)
+        except Exception:
+            return None
+
+    def stats(self):
+        with self._lock:
+            return dict(self.counters, entries=len(self.hashes))
+
+# Shared by every session of this Streamlit process
+@st.cache_resource(show_spinner=False)
+def get_phash_cache():
+    return PerceptualHashCache(maxsize=phash_cache_size, workers=dedup_workers)
+
+
+class HammingIndex:
+    """Finds 64-bit hashes within ``max_distance`` bits of a given one.
+
+    Each hash is split into ``max_distance + 1`` equal bands (any bits left
+    over are not banded) and filed under every band value. Two hashes at most
+    ``max_distance`` bits apart agree exactly on at least one band, so only
+    hashes sharing a band bucket are compared bit by bit.
+    """
+
+    def __init__(self, max_distance=6):
+        if not 0 <= max_distance < 64:
+            raise ValueError(f"max_distance must be 0-63 bits, got {max_distance}")
+        self.max_distance = max_distance
+        self.width = 64 // (max_distance + 1)
+        self.buckets = [{} for _ in range(max_distance + 1)]
+
+    def _bands(self, value):
+        mask = (1 << self.width) - 1
+        return [(value >> (band * self.width)) & mask for band in range(len(self.buckets))]
+
+    def find(self, value):
+        """A stored hash near ``value``, or None."""
+        for bucket, band in zip(self.buckets, self._bands(value)):
+            for other in bucket.get(band, ()):
+                if bin(value ^ other).count("1") <= self.max_distance:
+                    return other
+        return None
+
+    def add(self, value):
+        for bucket, band in zip(self.buckets, self._bands(value)):
+            bucket.setdefault(band, []).append(value)
+
+
+def dedupe_images(records, index=None):
+    """Drop ImageRecords whose thumbnail nearly matches an earlier one or one already in ``index``.
+
+    The first (best ranked) copy is kept. Records without a usable thumbnail
+    are kept, and so are flat thumbnails, whose hash carries no detail.
+    """
+    index = index if index is not None else HammingIndex(dedup_max_distance)
+    kept = []
+    with get_metrics().span("dedupe_images"):
+        for record, value in zip(records, get_phash_cache().get_many(records)):
+            if value is not None and 4 <= bin(value).count("1") <= 60:
+                if index.find(value) is not None:
+                    continue
+                index.add(value)
+            kept.append(record)
+    get_metrics().inc("results_deduplicated", len(records) - len(kept))
+    return kept
+
+
+class ResultCursor:
+    """Lazily loaded, filtered search results for one result panel.
+
+    Upstream pages are only requested when ``ensure`` asks for more filtered
+    images than are loaded; each page is normalized to ImageRecords, filtered
+    as it arrives and appended to ``images``, so the list can be handed to the
+    UI and grows in place. Raw payloads are only kept when ``keep_raw`` is set.
+    Setting ``cancelled`` stops loading before the next upstream page.
+    Pages are scheduled as interactive until ``visible`` images are loaded
+    and as read-ahead after that; when the scheduler defers one, loading
+    stops with ``deferred`` set and the next ``ensure`` tries again. With
+    ``dedupe`` near-duplicates of images already loaded are dropped from
+    each page, across pages and providers; the images still missing to
+    reach ``visible`` are hashed and appended first, the rest of the page
+    after them.
+
+    Each provider is paged on its own: a provider that misses the fan-out
+    deadline or whose request failed has the same page asked for again next
+    time (and gives up after ``max_misses`` misses in a row), and the cursor
+    is only exhausted once every provider has run out of results. When no
+    provider answered a page, loading stops until the next ``ensure``.
+    """
+
+    max_misses = 3
+
+    def __init__(self, query, orientation='landscape', providers=("unsplash",), filter_fn=None, per_page=30, max_pages=15, keep_raw=False, cancelled=None, dedupe=False):
+        self.query = query
+        self.orientation = orientation
+        self.providers = tuple(providers)
+        self.filter_fn = filter_fn
+        self.per_page = per_page
+        self.max_pages = max_pages
+        self.keep_raw = keep_raw
+        self.images = []
+        self.raw_images = []
+        self.raw_count = 0
+        self.pages_fetched = 0
+        self.total = None
+        self.provider_pages = dict.fromkeys(self.providers, 0)
+        self.provider_raw = dict.fromkeys(self.providers, 0)
+        self.provider_totals = {}
+        self.provider_misses = dict.fromkeys(self.providers, 0)
+        self.provider_done = set()
+        self.exhausted = False
+        self.deferred = False
+        self.cancelled = cancelled or threading.Event()
+        self.seen = HammingIndex(dedup_max_distance) if dedupe else None
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_records(cls, query, orientation, records):
+        """A fully loaded cursor over already filtered records (e.g. from the precomputed index)."""
+        cursor = cls(query, orientation=orientation, providers=())
+        cursor.images.extend(records)
+        cursor.total = cursor.raw_count = len(records)
+        cursor.exhausted = True
+        return cursor
+
+    def ensure(self, count, visible=0):
+        """Fetch upstream pages until ``count`` filtered images are loaded or results run out."""
+        for _ in self.iter_pages(count, visible):
+            pass
+        return len(self.images)
+
+    def iter_pages(self, count, visible=0):
+        """Like ``ensure``, but yields each page's filtered images as soon as it is appended."""
+        self.deferred = False
+        while True:
+            with self._lock:
+                if len(self.images) >= count or self.exhausted or self.cancelled.is_set():
+                    return
+                priority = "interactive" if self.pages_fetched == 0 or len(self.images) < visible else "read_ahead"
+                try:
+                    kept = self._fetch_next_page(priority, visible)
+                except UpstreamDeferred:
+                    self.deferred = True
+                    return
+            if kept is None:
+                return  # every provider failed or was late, the next ensure asks again
+            yield kept
+
+    def _fetch_next_page(self, priority="interactive", visible=0):
+        filters = self.filter_fn if hasattr(self.filter_fn, "hints") else None
+        pending = [provider for provider in self.providers if provider not in self.provider_done]
+        if len(self.providers) == 1:
+            provider = self.providers[0]
+            results = {provider: fetch_images_page(
+                self.query, page=self.provider_pages[provider] + 1, per_page=self.per_page, orientation=self.orientation,
+                providers=self.providers, filters=filters, priority=priority,
+            )}
+            late = []
+        else:
+            results, late = fetch_provider_pages(
+                self.query, {provider: self.provider_pages[provider] + 1 for provider in pending}, per_page=self.per_page,
+                orientation=self.orientation, filters=filters, priority=priority,
+            )
+        self.pages_fetched += 1
+        # A failed request comes back as ([], None); its error was already reported
+        failed = [provider for provider, (page_images, total) in results.items() if total is None and not page_images]
+        for provider in late + failed:
+            self.provider_misses[provider] += 1
+            if self.provider_misses[provider] >= self.max_misses:
+                self.provider_done.add(provider)
+        answered = {provider: result for provider, result in results.items() if provider not in failed}
+        for provider, (page_images, total) in answered.items():
+            self._advance(provider, page_images, total)
+        self.exhausted = len(self.provider_done) == len(self.providers)
+        if self.provider_totals:
+            self.total = sum(self.provider_totals.values())
+        if not answered:
+            return None
+        images = interleave_results([answered[provider][0] for provider in self.providers if provider in answered])
+        self.raw_count += len(images)
+        if self.keep_raw:
+            self.raw_images.extend(images)
+        records = normalize_images(images)
+        with get_metrics().span("filter_page", orientation=self.orientation):
+            if hasattr(self.filter_fn, "hints"):  # FilterPipeline: skip what the provider already filtered
+                kept = apply_filters(self.filter_fn, records)
+            else:
+                kept = self.filter_fn(records) if self.filter_fn else records
+        if self.seen is not None:
+            # Hashing waits on thumbnail downloads: append the rows on screen before hashing the rest
+            head = max(0, visible - len(self.images))
+            shown = dedupe_images(kept[:head], self.seen)
+            self.images.extend(shown)
+            rest = dedupe_images(kept[head:], self.seen)
+            self.images.extend(rest)
+            kept = shown + rest
+        else:
+            self.images.extend(kept)
+        get_metrics().inc("results_kept", len(kept), orientation=self.orientation)
+        return kept
+
+    def _advance(self, provider, images, total):
+        """Record one answered page for ``provider`` and whether it has more."""
+        self.provider_pages[provider] += 1
+        self.provider_misses[provider] = 0
+        self.provider_raw[provider] += len(images)
+        if total is not None:
+            self.provider_totals[provider] = total
+        if not images or self.provider_pages[provider] >= self.max_pages:
+            self.provider_done.add(provider)
+        elif total is not None:
+            # Providers cap page sizes (Unsplash serves at most 30), so use the
+            # reported total rather than a short page to detect the end
+            if self.provider_raw[provider] >= total:
+                self.provider_done.add(provider)
+        elif len(images) < self.per_page:
+            self.provider_done.add(provider)
+
+    def has_more(self):
+        return not self.exhausted
+
+
+def index_key(city, attraction, orientation, providers):
+    """Lookup key shared by batch_index.py and the app."""
+    normalize = lambda text: " ".join((text or "").lower().split())
+    return normalize(city), normalize(attraction), orientation, ",".join(sorted(providers))
+
+
+class PrecomputedIndex:
+    """Read-only view of the Parquet dataset written by batch_index.py.
+
+    Part files are memory-mapped, and row positions are grouped by
+    ``index_key`` once, so a lookup only materializes the rows it returns.
+    """
+
+    def __init__(self, path):
+        files = sorted(glob.glob(os.path.join(path, "*.parquet"))) if os.path.isdir(path) else [path]
+        tables = [pq.read_table(f, memory_map=True) for f in files]
+        self.table = pa.concat_tables(tables) if tables else None
+        self.rows = {}
+        if self.table is None:
+            return
+        keys = zip(
+            self.table.column("city").to_pylist(),
+            self.table.column("attraction").to_pylist(),
+            self.table.column("orientation").to_pylist(),
+            self.table.column("providers").to_pylist(),
+        )
+        for row, (city, attraction, orientation, providers) in enumerate(keys):
+            key = index_key(city, attraction, orientation, providers.split(","))
+            self.rows.setdefault(key, []).append(row)
+
+    def lookup(self, city, attraction, orientation, providers):
+        """ImageRecords for a search, in ranked order, or None if it was not precomputed."""
+        rows = self.rows.get(index_key(city, attraction, orientation, providers))
+        if rows is None:
+            return None
+        subset = self.table.take(rows).select(list(ImageRecord._fields)).to_pylist()
+        return [ImageRecord(**dict(row, tags=tuple(row["tags"] or ()))) for row in subset]
+
+
+# Only the current version: an index rebuilt for new part files releases the old one
+@st.cache_resource(max_entries=1, show_spinner=False)
+def _load_precomputed_index(path, signature):
+    return PrecomputedIndex(path)
+
+def get_precomputed_index():
+    """The configured precomputed index (reloaded when its files change), or None."""
+    if not precomputed_index_path or not os.path.exists(precomputed_index_path):
+        return None
+    if os.path.isdir(precomputed_index_path):
+        files = sorted(glob.glob(os.path.join(precomputed_index_path, "*.parquet")))
+    else:
+        files = [precomputed_index_path]
+    signature = tuple((f, os.path.getmtime(f)) for f in files)
+    return _load_precomputed_index(precomputed_index_path, signature)
+
+def open_result_cursor(query, orientation, providers, city, attraction="", cancelled=None, prefetch=True):
+    """Cursor for a panel search: precomputed results when indexed, else a lazy upstream cursor.
+
+    With ``prefetch`` the first thumbnail pages (plus read-ahead) are loaded before returning.
+    """
+    index = get_precomputed_index()
+    records = index.lookup(city, attraction, orientation, providers) if index else None
+    if records is not None:
+        get_metrics().inc("precomputed_index_lookups", result="hit")
+        return ResultCursor.from_records(query, orientation, records)
+    if index:
+        get_metrics().inc("precomputed_index_lookups", result="miss")
+    cursor = ResultCursor(query, orientation=orientation, providers=providers, filter_fn=panel_filter(orientation), per_page=lazy_page_size, keep_raw=keep_debug_payloads, cancelled=cancelled, dedupe=dedup_results)
+    if prefetch:
+        cursor.ensure((1 + read_ahead_pages) * 3, visible=3)
+    return cursor
+
+
+class SearchJob:
+    """One panel search (``open_result_cursor``) running on a background thread.
+
+    The thread waits ``debounce`` seconds before going upstream. ``cancel``
+    stops it during that wait or before the cursor's next upstream page, so a
+    superseded search stops spending quota. ``cursor`` is set before the
+    first upstream page is requested and its ``images`` grow page by page,
+    so the panel can show the first thumbnails while read-ahead continues.
+    Errors and warnings are collected in ``notices`` as (level, message)
+    for the panel to show, since st.* calls from this thread never reach
+    the page.
+    """
+
+    def __init__(self, query, orientation, providers, city, attraction="", debounce=0.0):
+        self.query = query
+        self.cursor = None
+        self.error = None
+        self.notices = []
+        self.cancelled = threading.Event()
+        self._done = threading.Event()
+        ctx = get_script_run_ctx(suppress_warning=True)
+        self._thread = threading.Thread(
+            target=self._run, args=(ctx, query, orientation, providers, city, attraction, debounce), daemon=True
+        )
+        self._thread.start()
+
+    def _run(self, ctx, query, orientation, providers, city, attraction, debounce):
+        if ctx is not None:
+            add_script_run_ctx(ctx=ctx)
+        _notices.sink = self.notices
+        try:
+            if debounce and self.cancelled.wait(debounce):
+                return
+            self.cursor = open_result_cursor(query, orientation, providers, city, attraction, cancelled=self.cancelled, prefetch=False)
+            started = time.monotonic()
+            for _ in self.cursor.iter_pages((1 + read_ahead_pages) * 3, visible=3):
+                if started is not None and self.cursor.images:
+                    get_metrics().observe("time_to_first_results", time.monotonic() - started, orientation=orientation)
+                    started = None
+            if self.cursor.deferred and not self.cursor.images:
+                report("warning", "The image API quota is nearly used up, try this search again in a moment.")
+        except Exception as e:
+            self.error = e
+            report("error", f"Search failed: {e}")
+        finally:
+            result = "cancelled" if self.cancelled.is_set() else "failed" if self.error else "completed"
+            get_metrics().inc("search_jobs", result=result)
+            self._done.set()
+
+    def cancel(self):
+        self.cancelled.set()
+
+    def wait(self, timeout=None):
+        """True once the search has finished (or stopped after being cancelled)."""
+        return self._done.wait(timeout)
+
+
+def _normalize_text(text):
+    return " ".join((text or "").lower().split())
+
+class QueryLog:
+    """Append-only JSONL log of highlight searches, counted per city."""
+
+    def __init__(self, path):
+        self.path = path
+        self.counts = {}
+        self._lock = threading.Lock()
+        if path and os.path.exists(path):
+            with open(path, encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        item = json.loads(line)
+                    except ValueError:
+                        continue
+                    self._count(item.get("city"), item.get("attraction"))
+
+    def _count(self, city, attraction):
+        city, attraction = _normalize_text(city), _normalize_text(attraction)
+        if city and attraction:
+            attractions = self.counts.setdefault(city, {})
+            attractions[attraction] = attractions.get(attraction, 0) + 1
+
+    def record(self, city, attraction):
+        with self._lock:
+            self._count(city, attraction)
+            if not self.path:
+                return
+            if os.path.dirname(self.path):
+                os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(json.dumps({"city": city, "attraction": attraction, "ts": time.time()}) + "\n")
+
+    def top(self, city, limit):
+        """The ``limit`` most searched attractions for ``city``."""
+        with self._lock:
+            attractions = self.counts.get(_normalize_text(city), {})
+            return sorted(attractions, key=lambda a: (-attractions[a], a))[:limit]
+
+class SpeculativePrefetcher:
+    """Warms the search cache with the likely highlight searches for a city.
+
+    Candidates come from the configured ``attractions`` list first, then from
+    the query log. Prefetches run one at a time on a single background thread,
+    only after the city search that triggered them has finished (not at all
+    if it was cancelled), and request the same first page a highlight panel
+    asks for. Upstream requests are capped by a ``budget_per_hour`` token
+    bucket and scheduled as background work; cached pages cost nothing, and
+    searches over budget or deferred by the upstream scheduler are skipped
+    rather than queued. With ``dedup_results`` the page's thumbnails are
+    hashed as well, so the highlight panel does not wait on them.
+    """
+
+    def __init__(self, query_log, attractions=None, per_city=3, budget_per_hour=300):
+        self.query_log = query_log
+        self.attractions = {_normalize_text(city): list(items) for city, items in (attractions or {}).items()}
+        self.per_city = per_city
+        self.limiter = RateLimiter(budget_per_hour / 3600, capacity=max(1, per_city * 2))
+        self._pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="speculative-prefetch")
+        self._queued = set()
+        self._lock = threading.Lock()
+
+    def candidates(self, city):
+        picked = []
+        for attraction in self.attractions.get(_normalize_text(city), []) + self.query_log.top(city, self.per_city):
+            attraction = _normalize_text(attraction)
+            if attraction and attraction not in picked:
+                picked.append(attraction)
+        return picked[:self.per_city]
+
+    def schedule(self, city, providers, after=None):
+        """Queue prefetches for ``city``; they start once ``after`` (a SearchJob) is done."""
+        for attraction in self.candidates(city):
+            key = (_normalize_text(city), attraction, tuple(providers))
+            with self._lock:
+                if key in self._queued:
+                    continue
+                self._queued.add(key)
+            self._pool.submit(self._prefetch, key, city, attraction, tuple(providers), after)
+
+    def _prefetch(self, key, city, attraction, providers, after):
+        result = "failed"
+        try:
+            if after is not None:
+                after.wait()
+                if after.cancelled.is_set():
+                    # The editor replaced that city search, nobody will look at these highlights
+                    result = "cancelled"
+                    return
+            index = get_precomputed_index()
+            query = f"{city} {attraction}"
+            filters = panel_filter("landscape")
+            if index is not None and index_key(city, attraction, "landscape", providers) in index.rows:
+                result = "indexed"
+            elif search_page_cached(query, 1, lazy_page_size, "landscape", providers, filters):
+                result = "cached"
+            elif not self.limiter.try_acquire(len(providers)):
+                result = "over_budget"
+            else:
+                fetch_images_page(query, page=1, per_page=lazy_page_size, orientation="landscape", providers=providers, filters=filters, priority="background")
+                result = "fetched"
+            if dedup_results and result in ("cached", "fetched"):
+                # Served from the search cache now; hashing only downloads thumbnails
+                images, _ = fetch_images_page(query, page=1, per_page=lazy_page_size, orientation="landscape", providers=providers, filters=filters, priority="background")
+                get_phash_cache().get_many(apply_filters(filters, normalize_images(images)))
+        except UpstreamDeferred:
+            result = "deferred"
+        finally:
+            get_metrics().inc("speculative_prefetch", result=result)
+            with self._lock:
+                self._queued.discard(key)
+
+# Shared by every session of this Streamlit process
+@st.cache_resource(show_spinner=False)
+def get_query_log():
+    return QueryLog(query_log_path)
+
+@st.cache_resource(show_spinner=False)
+def get_speculative_prefetcher():
+    attractions = {}
+    if prefetch_attractions_path and os.path.exists(prefetch_attractions_path):
+        with open(prefetch_attractions_path, encoding="utf-8") as f:
+            attractions = json.load(f)
+    return SpeculativePrefetcher(get_query_log(), attractions, per_city=prefetch_per_city, budget_per_hour=prefetch_budget)
+
+
 # Function to get the thumbnail URL (for Getty and Unsplash)
 def get_thumbnail_url(img_data):
     """Get the thumbnail URL for Getty and Unsplash images."""
+    if not isinstance(img_data, dict):  # ImageRecord
+        return img_data.thumb_url
     thumb_url = None
     # For Getty images
     if 'display_sizes' in img_data:
@@ -195,7 +2309,9 @@ def get_thumbnail_url(img_data):
 
 # Function to get the largest image URL (for Getty and Unsplash)
 def get_largest_image_url(img_data):
-    """Get the largest image URL for Getty and Unsplash images."""
+    """Get the largest image URL for Getty and Unsplash images (for export; display uses rendition_url)."""
+    if not isinstance(img_data, dict):  # ImageRecord
+        return img_data.full_url
     if "display_sizes" in img_data:
         # Prefer 'comp', then 'preview', then 'thumb'
         preferred_order = ["comp", "preview", "thumb"]
@@ -217,13 +2333,51 @@ def get_largest_image_url(img_data):
     
     return None
 
+# Nominal longest side in pixels of Getty's display sizes, smallest first
+getty_display_sizes = [("thumb", 170), ("preview", 612), ("comp", 1024), ("high_res_comp", 2048)]
+
+def sized_unsplash_url(url, size):
+    """Unsplash URL resized on their image CDN so its longest side is ``size`` pixels."""
+    parts = urllib.parse.urlsplit(url)
+    params = dict(urllib.parse.parse_qsl(parts.query))
+    params.pop("dpr", None)
+    params.update({"w": str(size), "h": str(size), "fit": "max", "fm": "jpg", "q": "80"})
+    return urllib.parse.urlunsplit(parts._replace(query=urllib.parse.urlencode(params)))
+
+# Function to get the smallest image variant that still fills a display size
+def rendition_url(img_data, size):
+    """URL of the smallest variant whose longest side is at least ``size`` pixels.
+
+    Unsplash images are requested at exactly that size from their raw URL;
+    for Getty the first large enough ``display_sizes`` entry is used, or the
+    largest one available.
+    """
+    if not isinstance(img_data, dict):  # ImageRecord
+        if img_data.provider == "unsplash":
+            return sized_unsplash_url(img_data.full_url, size) if img_data.full_url else img_data.preview_url
+        candidates = [(img_data.thumb_url, 170), (img_data.preview_url, 612), (img_data.full_url, 1024)]
+    elif "urls" in img_data:  # Unsplash Images
+        base = img_data["urls"].get("raw") or img_data["urls"].get("full")
+        return sized_unsplash_url(base, size) if base else None
+    else:  # Getty Images
+        uris = {s.get("name"): s.get("uri") for s in img_data.get("display_sizes", [])}
+        candidates = [(uris.get(name), nominal) for name, nominal in getty_display_sizes]
+    candidates = [(url, nominal) for url, nominal in candidates if url]
+    for url, nominal in candidates:
+        if nominal >= size:
+            return url
+    return candidates[-1][0] if candidates else None
+
 # Function to get the photographer/source (for Getty and Unsplash)
 def get_image_source(img_data):
     """Get the image description and source for Getty and Unsplash images."""
     image_description = ""
     source = ""
 
-    if 'title' in img_data:  # Getty Images
+    if not isinstance(img_data, dict):  # ImageRecord
+        image_description = img_data.description
+        source = img_data.attribution
+    elif 'title' in img_data:  # Getty Images
         image_description = img_data.get('title', 'No description available')
         source = "Getty Images"
     elif 'user' in img_data:  # Unsplash Images
@@ -235,54 +2389,369 @@ def get_image_source(img_data):
     return f"Image: {image_description}\n\nSource: {source}"
 
 
+@timed("filter_portrait")
 def filter_portrait(images, orientation='portrait'):
     """Filter portrait images from Getty and Unsplash."""
-    portrait_images = []
-    for img in images:
-        # For Getty images
-        if 'max_dimensions' in img:
-            height = img['max_dimensions'].get('height', 0)
-            width = img['max_dimensions'].get('width', 0)
-        # For Unsplash images
-        else:
-            height = img.get('height', 0)
-            width = img.get('width', 0)
-        
-        # If the height is greater than the width, it's portrait
-        if height > width:
-            portrait_images.append(img)
-    
-    return portrait_images
+    return portrait_filter(images)
 
+@timed("filter_landscape")
 def filter_landscape(images, orientation='landscape'):
     """Filter landscape images from Getty and Unsplash."""
-    landscape_images = []
-    for img in images:
-        # For Getty images (check 'max_dimensions' for width and height)
-        if 'max_dimensions' in img:
-            height = img['max_dimensions'].get('height', 0)
-            width = img['max_dimensions'].get('width', 0)
-        # For Unsplash images (directly check 'height' and 'width' in the image object)
-        elif 'height' in img and 'width' in img:
-            height = img['height']
-            width = img['width']
-        else:
-            # If neither Getty nor Unsplash image structure, skip
-            continue
-        
-        # If width > height, it's considered landscape
-        if width > height:
-            landscape_images.append(img)
-    
-    return landscape_images
+    return landscape_filter(images)
 
 
 
+# Filter used by the result panels: orientation, plus the content filter when enabled
+def panel_filter(orientation):
+    pipeline = portrait_filter if orientation == 'portrait' else landscape_filter
+    if panel_content_filter:
+        pipeline = pipeline.then(content_filter)
+    return pipeline
+
+
+# Sidebar panel with search cache statistics and invalidation
+def render_cache_admin():
+    cache = get_search_cache()
+    with st.sidebar.expander("Search cache"):
+        stats = cache.stats()
+        st.write(
+            f"Hit rate **{stats['hit_rate']:.0%}** "
+            f"({stats['memory_hits']} memory, {stats['disk_hits']} disk, {stats['misses']} misses)"
+        )
+        st.write(
+            f"{stats['memory_entries']} pages in memory, {stats['disk_entries']} pages on disk "
+            f"({stats['disk_bytes'] / 1024 / 1024:.1f} MB), {stats['evictions']} evicted"
+        )
+        flights = get_single_flight().stats()
+        st.write(f"{flights['in_flight']} searches in flight, {flights['coalesced']} joined an identical search")
+        for name, quota in get_upstream_scheduler().stats().items():
+            if name not in provider_labels:
+                continue
+            left = f"{quota['remaining']} of {quota['limit']} requests left" if quota["remaining"] is not None else "quota not reported yet"
+            tokens = f", {quota['tokens']:.0f} burst tokens" if quota["tokens"] is not None else ""
+            st.write(f"{provider_labels[name]}: {left}{tokens}, {quota['waiting']} waiting")
+        provider = st.selectbox("Provider", ["all", "getty", "unsplash"], key="cache_admin_provider")
+        query = st.text_input("Query (empty for all)", key="cache_admin_query")
+        if st.button("Invalidate", key="cache_admin_invalidate"):
+            removed = cache.invalidate(
+                provider=None if provider == "all" else provider,
+                query=query if query.strip() else None,
+            )
+            st.write(f"Removed {removed} cached pages")
+
+
+# Search sections, top to bottom. Highlight sections search "<city> <attraction>";
+# add an entry here to add another section to the page.
+search_panels = [
+    {
+        "key": "city",
+        "title": "Search Destination City",
+        "input_label": "Enter city",
+        "button_label": "Search City",
+        "orientation": "portrait",
+        "results_label": "City Results",
+        "selected_label": "Destination (Full Size)",
+        "combine_with_city": False,
+    },
+    {
+        "key": "attraction",
+        "title": "Search Highlight Attraction",
+        "input_label": "Enter attraction",
+        "button_label": "Search Attraction",
+        "orientation": "landscape",
+        "results_label": "Attraction Results",
+        "selected_label": "Highlight (Full Size)",
+        "combine_with_city": True,
+    },
+    {
+        "key": "attraction2",
+        "title": "Search Second Highlight Attraction",
+        "input_label": "Enter attraction",
+        "button_label": "Search Attraction",
+        "orientation": "landscape",
+        "results_label": "Attraction 2 Results",
+        "selected_label": "Highlight 2 (Full Size)",
+        "combine_with_city": True,
+    },
+]
+
+def init_panel_state(panel):
+    """Session state used by one search panel, prefixed with its key."""
+    key = panel["key"]
+    defaults = {
+        f"{key}_query": "",
+        f"{key}_page": 1,
+        f"{key}_total": 0,
+        f"{key}_images": [],
+        f"{key}_cursor": None,
+        f"{key}_job": None,
+        f"{key}_notices": [],
+        f"{key}_auto_poll": False,
+        f"{key}_input_prev": "",
+        f"selected_{key}_image": "",
+        f"selected_{key}_photographer": "",
+        f"selected_{key}_image_data": None,
+    }
+    for name, value in defaults.items():
+        if name not in st.session_state:
+            st.session_state[name] = value
+
+def _in_fragment_rerun():
+    ctx = get_script_run_ctx(suppress_warning=True)
+    return bool(ctx and ctx.fragment_ids_this_run)
+
+def _rerun_panel():
+    """Rerun only the current panel when it is running on its own, else the whole app."""
+    st.rerun(scope="fragment" if _in_fragment_rerun() else "app")
+
+def _poll_panel(key):
+    """Rerun the panel soon to show search progress.
+
+    Full-app runs never stop here: a panel with a running search was
+    declared with ``run_every`` and is polled by the browser instead, so the
+    rest of the page still renders. Fragment runs of a panel whose search
+    started after the last full run rerun themselves.
+    """
+    if _in_fragment_rerun() and not st.session_state[f"{key}_auto_poll"]:
+        st.rerun(scope="fragment")
+
+# Selected image at preview size; the full-resolution original is only linked for export
+def render_preview(img_data):
+    preview_url = rendition_url(img_data, preview_display_size)
+    if not preview_url:
+        return
+    slot = st.empty()
+    thumb_url = get_thumbnail_url(img_data)
+    if progressive_preview and thumb_url and not get_image_cache().contains(preview_url, preview_display_size):
+        # The thumbnail is already cached from the results grid, show it while the preview loads
+        slot.image(cached_image(thumb_url, thumb_display_size), width=preview_display_size)
+    with get_metrics().span("preview_load"):
+        slot.image(cached_image(preview_url, preview_display_size), width=preview_display_size)
+
+# One search section (input, paged thumbnails, full-size selection). Runs as a
+# fragment, so typing, paging and selecting only re-execute this panel; while its
+# search is running the fragment reruns itself every SEARCH_POLL_INTERVAL seconds
+def search_panel(panel, providers):
+    polling = st.session_state[f"{panel['key']}_job"] is not None
+    st.session_state[f"{panel['key']}_auto_poll"] = polling
+    st.fragment(_search_panel, run_every=search_poll_interval if polling else None)(panel, providers)
+
+def _search_panel(panel, providers):
+    key = panel["key"]
+    state = st.session_state
+    with get_metrics().span("render_panel", panel=key):
+        st.subheader(panel["title"])
+        st.text_input(panel["input_label"], key=f"{key}_input_value")
+
+        search_triggered = False
+        debounce = 0.0
+        if st.button(panel["button_label"], key=f"search_{key}"):
+            search_triggered = True
+        elif state[f"{key}_input_value"] != state[f"{key}_input_prev"] and state[f"{key}_input_value"].strip():
+            search_triggered = True
+            debounce = search_debounce
+
+        if search_triggered:
+            state[f"{key}_query"] = state[f"{key}_input_value"]
+            state[f"{key}_input_prev"] = state[f"{key}_input_value"]
+            state[f"{key}_page"] = 1
+            if state[f"{key}_job"] is not None:
+                state[f"{key}_job"].cancel()
+            if panel["combine_with_city"]:
+                # Combine city and attraction query
+                query = f"{state.city_query} {state[f'{key}_query']}".strip()
+                job = SearchJob(query, panel["orientation"], providers, city=state.city_query, attraction=state[f"{key}_query"], debounce=debounce)
+            else:
+                job = SearchJob(state[f"{key}_query"], panel["orientation"], providers, city=state[f"{key}_query"], debounce=debounce)
+            state[f"{key}_job"] = job
+            state[f"{key}_notices"] = job.notices
+            if panel["combine_with_city"]:
+                if state.city_query.strip():
+                    get_query_log().record(state.city_query, state[f"{key}_query"])
+            elif prefetch_per_city > 0:
+                # Warm the cache for the highlights editors usually search next
+                get_speculative_prefetcher().schedule(state[f"{key}_query"], providers, after=job)
+            state[f"{key}_cursor"] = None
+            state[f"{key}_images"] = []
+            state[f"{key}_total"] = 0
+            state[f"selected_{key}_image"] = ""
+            state[f"selected_{key}_photographer"] = ""
+            state[f"selected_{key}_image_data"] = None
+
+        job = state[f"{key}_job"]
+        if job is not None:
+            finished = job.wait(search_poll_interval)
+            if job.cursor is not None and state[f"{key}_cursor"] is not job.cursor:
+                # The cursor's image list fills in page by page, so show it right away
+                state[f"{key}_cursor"] = job.cursor
+                state[f"{key}_images"] = job.cursor.images
+                if keep_debug_payloads:
+                    state[f"{key}_debug"] = job.cursor.raw_images  # Store debug info
+            if finished:
+                state[f"{key}_job"] = None
+                if _in_fragment_rerun() and (not panel["combine_with_city"] or state[f"{key}_auto_poll"]):
+                    # Highlight panels show and search relative to the city, refresh them too;
+                    # a full run also stops the browser polling this panel
+                    st.rerun(scope="app")
+            elif not state[f"{key}_images"]:
+                # Keep the run short so a newer query for this panel gets in and cancels this one
+                st.caption(f"Searching **{job.query}** …")
+                _poll_panel(key)
+        # Collected by the search thread, shown until the next search
+        for level, message in dict.fromkeys(list(state[f"{key}_notices"])):
+            getattr(st, level)(message)
+
+        results_col, selected_col = st.columns([3, 2], gap="large")
+
+        with results_col:
+            if state[f"{key}_query"] and state[f"{key}_images"]:
+                with st.expander(panel["results_label"], expanded=True):
+                    images = state[f"{key}_images"]
+                    page = state[f"{key}_page"]
+                    per_page = 3
+                    loading = state[f"{key}_job"] is not None
+                    if not loading:
+                        # Load more upstream results only when paging gets close to the end
+                        state[f"{key}_cursor"].ensure((page + read_ahead_pages) * per_page, visible=page * per_page)
+                    state[f"{key}_total"] = len(images)
+                    shown_query = f"{state.city_query} {state[f'{key}_query']}" if panel["combine_with_city"] else state[f"{key}_query"]
+                    st.write(f"Showing **{shown_query}**, page {page}")
+                    more = ", loading more …" if loading else ", more paused while the API quota recovers" if state[f"{key}_cursor"].deferred else ""
+                    st.caption(f"{len(images)} images{more}")
+                    start = (page - 1) * per_page
+                    end = start + per_page
+                    page_images = images[start:end]
+                    # Download this page's thumbnails in parallel (the loop below waits for each),
+                    # and warm the next page so a page flip is served locally
+                    prefetch_thumbnails(images[start:end + per_page])
+                    img_cols = st.columns(len(page_images))
+                    for i, img_data in enumerate(page_images):
+                        with img_cols[i]:
+                            thumb_url = get_thumbnail_url(img_data)
+                            if thumb_url:
+                                st.image(cached_image(thumb_url, thumb_display_size), caption=provider_labels.get(getattr(img_data, "provider", None)))
+                            else:
+                                st.write("No thumbnail available")
+                            if st.button("Select", key=f"select_{key}_page{page}_{i}"):
+                                comp_url = get_largest_image_url(img_data)
+                                state[f"selected_{key}_image"] = comp_url or thumb_url
+                                state[f"selected_{key}_photographer"] = get_image_source(img_data)
+                                state[f"selected_{key}_image_data"] = img_data
+
+                    # Pagination arrows
+                    pages = (len(images) // per_page) + (1 if len(images) % per_page > 0 else 0)
+                    col_btn1, col_btn2, col_spacer = st.columns([1, 1, 8])
+                    with col_btn1:
+                        if st.button("◀", key=f"{key}_prev") and page > 1:
+                            state[f"{key}_page"] -= 1
+                            _rerun_panel()
+                    with col_btn2:
+                        if st.button("▶", key=f"{key}_next") and page < pages:
+                            state[f"{key}_page"] += 1
+                            _rerun_panel()
+
+        with selected_col:
+            st.write(f"**{panel['selected_label']}**")
+            if state[f"selected_{key}_image_data"]:
+                render_preview(state[f"selected_{key}_image_data"])
+                image_source = get_image_source(state[f"selected_{key}_image_data"])  # Get formatted description and source
+                st.markdown(image_source)  # Display the image description and source with hyperlink
+                full_url = get_largest_image_url(state[f"selected_{key}_image_data"])
+                if full_url:
+                    st.link_button("Full resolution", full_url)
+
+        if state[f"{key}_job"] is not None:
+            # Results are still streaming in: refresh the thumbnails and the count
+            _poll_panel(key)
+
+
+# Export the selected images: full-resolution originals, crops and a manifest
+def selected_export_items():
+    state = st.session_state
+    items = []
+    for panel in search_panels:
+        img_data = state[f"selected_{panel['key']}_image_data"]
+        if not img_data:
+            continue
+        items.append({
+            "slot": panel["key"],
+            "url": get_largest_image_url(img_data),
+            "orientation": panel["orientation"],
+            "id": img_data.get("id") if isinstance(img_data, dict) else img_data.id,
+            "provider": img_data.get("provider") if isinstance(img_data, dict) else img_data.provider,
+            "attribution": get_image_source(img_data),
+        })
+    return items
+
+# Selections are made inside the panel fragments, so they are read when the button is clicked
+# (a full run) rather than listed here, which would be stale until the next full run
+def render_export():
+    state = st.session_state
+    st.subheader("Export")
+    st.caption("Downloads the images selected above with their crops and attributions.")
+    if st.button("Export selection", key="export_selection"):
+        items = selected_export_items()
+        if not items:
+            st.warning("Select images above to export them.")
+            return
+        name = "_".join(filter(None, [time.strftime("%Y%m%d-%H%M%S"), re.sub(r"\W+", "-", state.city_query.strip().lower())]))
+        out_dir = os.path.join(export_dir, name)
+        with st.spinner("Exporting …"), get_metrics().span("export"):
+            manifest = image_export.export_selection(
+                items, out_dir, image_export.parse_renditions(export_renditions), download_workers=export_download_workers
+            )
+        for item in manifest["items"]:
+            if item["error"]:
+                st.error(f"{item['slot']}: {item['error']}")
+        state.last_export = shutil.make_archive(out_dir, "zip", out_dir)
+        st.write(f"Exported {', '.join(item['slot'] for item in items)}")
+        # Offered in this run only, so later reruns don't load the archive into memory again
+        with open(state.last_export, "rb") as f:
+            st.download_button("Download export", f, file_name=os.path.basename(state.last_export), mime="application/zip")
+    elif state.get("last_export"):
+        st.caption(f"Last export: {state.last_export}")
+
+
+# Optional sidebar panel with timing spans, counters and metrics downloads
+def render_diagnostics():
+    if not st.sidebar.checkbox("Show diagnostics", key="show_diagnostics"):
+        return
+    metrics = get_metrics()
+    rows = metrics.snapshot()
+    with st.sidebar.expander("Diagnostics", expanded=True):
+        st.write("**Timings (ms)**")
+        st.dataframe(
+            [
+                {
+                    "span": row["name"] + "".join(f" {k}={v}" for k, v in row["labels"].items()),
+                    "count": row["count"],
+                    "mean": row["sum"] / row["count"] * 1000,
+                    "p95": row["p95"] * 1000,
+                    "max": row["max"] * 1000,
+                }
+                for row in rows if row["type"] == "span"
+            ],
+            hide_index=True,
+        )
+        st.write("**Counters and gauges**")
+        st.dataframe(
+            [
+                {"metric": row["name"] + "".join(f" {k}={v}" for k, v in row["labels"].items()), "value": row["value"]}
+                for row in rows if row["type"] != "span"
+            ],
+            hide_index=True,
+        )
+        st.download_button("Prometheus text", metrics.to_prometheus(), file_name="klm_image_search.prom")
+        st.download_button("JSONL", metrics.to_jsonl(), file_name="klm_image_search.jsonl")
+
+
 def main():
     st.set_page_config(layout="wide")
     st.title("Things to see | Image Selection ")
 
-    use_unsplash = st.checkbox("Use Unsplash", value=True)
+    source = st.radio("Image source", list(provider_choices), horizontal=True)
+    providers = provider_choices[source]
+    render_cache_admin()
 
     # --- Custom CSS to style expanders and buttons ---
     st.markdown(
@@ -309,289 +2778,14 @@ def main():
         unsafe_allow_html=True,
     )
 
-    # ---------- Initialize Session State ----------
-    # City-related state
-    if "city_query" not in st.session_state:
-        st.session_state.city_query = ""
-    if "city_page" not in st.session_state:
-        st.session_state.city_page = 1
-    if "city_total" not in st.session_state:
-        st.session_state.city_total = 0
-    if "city_images" not in st.session_state:
-        st.session_state.city_images = []
-    if "selected_city_image" not in st.session_state:
-        st.session_state.selected_city_image = ""
-    if "selected_city_photographer" not in st.session_state:
-        st.session_state.selected_city_photographer = ""
-    if "selected_city_image_data" not in st.session_state:
-        st.session_state.selected_city_image_data = None
-
-    # Attraction-related state
-    if "attraction_query" not in st.session_state:
-        st.session_state.attraction_query = ""
-    if "attraction_page" not in st.session_state:
-        st.session_state.attraction_page = 1
-    if "attraction_total" not in st.session_state:
-        st.session_state.attraction_total = 0
-    if "attraction_images" not in st.session_state:
-        st.session_state.attraction_images = []
-    if "selected_attraction_image" not in st.session_state:
-        st.session_state.selected_attraction_image = ""
-    if "selected_attraction_photographer" not in st.session_state:
-        st.session_state.selected_attraction_photographer = ""
-    if "selected_attraction_image_data" not in st.session_state:
-        st.session_state.selected_attraction_image_data = None
-
-    # Attraction2-related state
-    if "attraction2_query" not in st.session_state:
-        st.session_state.attraction2_query = ""
-    if "attraction2_page" not in st.session_state:
-        st.session_state.attraction2_page = 1
-    if "attraction2_total" not in st.session_state:
-        st.session_state.attraction2_total = 0
-    if "attraction2_images" not in st.session_state:
-        st.session_state.attraction2_images = []
-    if "selected_attraction2_image" not in st.session_state:
-        st.session_state.selected_attraction2_image = ""
-    if "selected_attraction2_photographer" not in st.session_state:
-        st.session_state.selected_attraction2_photographer = ""
-    if "selected_attraction2_image_data" not in st.session_state:
-        st.session_state.selected_attraction2_image_data = None
-
-    # ========== City Search Section ==========
-    st.subheader("Search Destination City")
-    city_input = st.text_input("Enter city", key="city_input_value")
-    if "city_input_prev" not in st.session_state:
-        st.session_state.city_input_prev = ""
-
-    city_search_triggered = False
-    if st.button("Search City"):
-        city_search_triggered = True
-    elif st.session_state.city_input_value != st.session_state.city_input_prev and st.session_state.city_input_value.strip():
-        city_search_triggered = True
-    if city_search_triggered:
-        st.session_state.city_query = st.session_state.city_input_value
-        st.session_state.city_input_prev = st.session_state.city_input_value
-        st.session_state.city_page = 1
-        all_images = fetch_many_images(st.session_state.city_query, max_pages=15, per_page=100, orientation='portrait', use_unsplash=use_unsplash)
-        filtered = filter_portrait(all_images)
-        st.session_state.city_images = filtered
-        st.session_state.city_total = len(filtered)
-        st.session_state.selected_city_image = ""
-        st.session_state.selected_city_photographer = ""
-        st.session_state.selected_city_image_data = None
-        st.session_state.city_debug = all_images  # Store debug info
-
-    city_col, destination_col = st.columns([3, 2], gap="large")
-
-    with city_col:
-        if st.session_state.city_query and st.session_state.city_images:
-            with st.expander("City Results", expanded=True):
-                st.write(f"Showing **{st.session_state.city_query}**, page {st.session_state.city_page}")
-                images = st.session_state.city_images
-                page = st.session_state.city_page
-                per_page = 3
-                start = (page - 1) * per_page
-                end = start + per_page
-                page_images = images[start:end]
-                img_cols = st.columns(len(page_images))
-                for i, img_data in enumerate(page_images):
-                    with img_cols[i]:
-                        thumb_url = get_thumbnail_url(img_data)
-                        if thumb_url:
-                            st.image(thumb_url)
-                        else:
-                            st.write("No thumbnail available")
-                        if st.button("Select", key=f"select_city_page{page}_{i}"):
-                            comp_url = get_largest_image_url(img_data)
-                            st.session_state.selected_city_image = comp_url or thumb_url
-                            st.session_state.selected_city_photographer = get_image_source(img_data)
-                            st.session_state.selected_city_image_data = img_data
-
-                # Pagination arrows for city section
-                pages = (len(images) // per_page) + (1 if len(images) % per_page > 0 else 0)
-                col_btn1, col_btn2, col_spacer = st.columns([1, 1, 8])
-                with col_btn1:
-                    if st.button("◀", key="city_prev") and page > 1:
-                        st.session_state.city_page -= 1
-                        st.rerun()
-                with col_btn2:
-                    if st.button("▶", key="city_next") and page < pages:
-                        st.session_state.city_page += 1
-                        st.rerun()
-
-    with destination_col:
-        st.write("**Destination (Full Size)**")
-        if st.session_state.selected_city_image_data:
-            full_url = get_largest_image_url(st.session_state.selected_city_image_data)
-            if full_url:
-                st.image(full_url, width=800)
-            image_source = get_image_source(st.session_state.selected_city_image_data)  # Get formatted description and source
-            st.markdown(image_source)  # Display the image description and source with hyperlink
-
-
-    # ========== First Attraction Search Section ==========
-    st.subheader("Search Highlight Attraction")
-    attraction_input = st.text_input("Enter attraction", key="attraction_input_value")
-    if "attraction_input_prev" not in st.session_state:
-        st.session_state.attraction_input_prev = ""
-
-    attraction_search_triggered = False
-    if st.button("Search Attraction"):
-        attraction_search_triggered = True
-    elif st.session_state.attraction_input_value != st.session_state.attraction_input_prev and st.session_state.attraction_input_value.strip():
-        attraction_search_triggered = True
-    
-    if attraction_search_triggered:
-        st.session_state.attraction_query = st.session_state.attraction_input_value
-        st.session_state.attraction_input_prev = st.session_state.attraction_input_value
-        st.session_state.attraction_page = 1
-
-        # Combine city and attraction query
-        combined_query = f"{st.session_state.city_query} {st.session_state.attraction_query}".strip()
-
-        # Encode the combined query
-        encoded_query = urllib.parse.quote_plus(combined_query)
-
-        # Fetch images from Getty and Unsplash with the encoded query
-        all_images = fetch_many_images(encoded_query, max_pages=15, per_page=100, orientation='landscape', use_unsplash=use_unsplash)
-        filtered = filter_landscape(all_images)
-        st.session_state.attraction_images = filtered
-        st.session_state.attraction_total = len(filtered)
-        st.session_state.selected_attraction_image = ""
-        st.session_state.selected_attraction_photographer = ""
-        st.session_state.selected_attraction_image_data = None
-        st.session_state.attraction_debug = all_images  # Store debug info
+    # ---------- Search panels ----------
+    for panel in search_panels:
+        init_panel_state(panel)
+    for panel in search_panels:
+        search_panel(panel, providers)
 
-    
-
-
-    attraction_col, highlight_col = st.columns([3, 2], gap="large")
-
-    with attraction_col:
-        if st.session_state.attraction_query and st.session_state.attraction_images:
-            with st.expander("Attraction Results", expanded=True):
-                st.write(
-                    f"Showing **{st.session_state.city_query} {st.session_state.attraction_query}**, "
-                    f"page {st.session_state.attraction_page}"
-                )
-                images = st.session_state.attraction_images
-                page = st.session_state.attraction_page
-                per_page = 3
-                start = (page - 1) * per_page
-                end = start + per_page
-                page_images = images[start:end]
-                img_cols = st.columns(len(page_images))
-                for i, img_data in enumerate(page_images):
-                    with img_cols[i]:
-                        thumb_url = get_thumbnail_url(img_data)
-                        if thumb_url:
-                            st.image(thumb_url)
-                        else:
-                            st.write("No thumbnail available")
-                        if st.button("Select", key=f"select_attr_page{page}_{i}"):
-                            comp_url = get_largest_image_url(img_data)
-                            st.session_state.selected_attraction_image = comp_url or thumb_url
-                            st.session_state.selected_attraction_photographer = get_image_source(img_data)
-                            st.session_state.selected_attraction_image_data = img_data
-
-                # Pagination arrows for first attraction section
-                pages = (len(images) // per_page) + (1 if len(images) % per_page > 0 else 0)
-                col_btn1, col_btn2, col_spacer = st.columns([1, 1, 8])
-                with col_btn1:
-                    if st.button("◀", key="attr_prev") and page > 1:
-                        st.session_state.attraction_page -= 1
-                        st.rerun()
-                with col_btn2:
-                    if st.button("▶", key="attr_next") and page < pages:
-                        st.session_state.attraction_page += 1
-                        st.rerun()
-    with highlight_col:
-        st.write("**Highlight (Full Size)**")
-        if st.session_state.selected_attraction_image_data:
-            full_url = get_largest_image_url(st.session_state.selected_attraction_image_data)
-            if full_url:
-                st.image(full_url, width=800)
-            image_source = get_image_source(st.session_state.selected_attraction_image_data)  # Get formatted description and source
-            st.markdown(image_source)  # Display the image description and source with hyperlink
-
-
-    # ========== Second Attraction Search Section ==========
-    st.subheader("Search Second Highlight Attraction")
-    attraction2_input = st.text_input("Enter attraction", key="attraction2_input_value")
-    if "attraction2_input_prev" not in st.session_state:
-        st.session_state.attraction2_input_prev = ""
-
-    attraction2_search_triggered = False
-    if st.button("Search Attraction", key="search_attraction2"):
-        attraction2_search_triggered = True
-    elif st.session_state.attraction2_input_value != st.session_state.attraction2_input_prev and st.session_state.attraction2_input_value.strip():
-        attraction2_search_triggered = True
-    
-    if attraction2_search_triggered:
-        st.session_state.attraction2_query = st.session_state.attraction2_input_value
-        st.session_state.attraction2_input_prev = st.session_state.attraction2_input_value
-        st.session_state.attraction2_page = 1
-        combined_query2 = f"{st.session_state.city_query} {st.session_state.attraction2_query}".strip()
-        all_images2 = fetch_many_images(combined_query2, max_pages=15, per_page=100, orientation='landscape', use_unsplash=use_unsplash)
-        filtered2 = filter_landscape(all_images2)
-        st.session_state.attraction2_images = filtered2
-        st.session_state.attraction2_total = len(filtered2)
-        st.session_state.selected_attraction2_image = ""
-        st.session_state.selected_attraction2_photographer = ""
-        st.session_state.selected_attraction2_image_data = None
-        st.session_state.attraction2_debug = all_images2  # Store debug info
-
-    attraction2_col, highlight2_col = st.columns([3, 2], gap="large")
-
-    with attraction2_col:
-        if st.session_state.attraction2_query and st.session_state.attraction2_images:
-            with st.expander("Attraction 2 Results", expanded=True):
-                st.write(
-                    f"Showing **{st.session_state.city_query} {st.session_state.attraction2_query}**, "
-                    f"page {st.session_state.attraction2_page}"
-                )
-                images2 = st.session_state.attraction2_images
-                page2 = st.session_state.attraction2_page
-                per_page2 = 3
-                start2 = (page2 - 1) * per_page2
-                end2 = start2 + per_page2
-                page_images2 = images2[start2:end2]
-                img_cols2 = st.columns(len(page_images2))
-                for i, img_data in enumerate(page_images2):
-                    with img_cols2[i]:
-                        thumb_url = get_thumbnail_url(img_data)
-                        if thumb_url:
-                            st.image(thumb_url)
-                        else:
-                            st.write("No thumbnail available")
-                        if st.button("Select", key=f"select_attr2_page{page2}_{i}"):
-                            comp_url = get_largest_image_url(img_data)
-                            st.session_state.selected_attraction2_image = comp_url or thumb_url
-                            st.session_state.selected_attraction2_photographer = get_image_source(img_data)
-                            st.session_state.selected_attraction2_image_data = img_data
-
-                # Pagination arrows for second attraction section
-                pages2 = (len(images2) // per_page2) + (1 if len(images2) % per_page2 > 0 else 0)
-                col_btn1, col_btn2, col_spacer = st.columns([1, 1, 8])
-                with col_btn1:
-                    if st.button("◀", key="attr2_prev") and page2 > 1:
-                        st.session_state.attraction2_page -= 1
-                        st.rerun()
-                with col_btn2:
-                    if st.button("▶", key="attr2_next") and page2 < pages2:
-                        st.session_state.attraction2_page += 1
-                        st.rerun()
-
-
-    with highlight2_col:
-        st.write("**Highlight 2 (Full Size)**")
-        if st.session_state.selected_attraction2_image_data:
-            full_url = get_largest_image_url(st.session_state.selected_attraction2_image_data)
-            if full_url:
-                st.image(full_url, width=800)
-            image_source = get_image_source(st.session_state.selected_attraction2_image_data)  # Get formatted description and source
-            st.markdown(image_source)  # Display the image description and source with hyperlink
+    render_export()
+    render_diagnostics()
 
 
 if __name__ == "__main__":